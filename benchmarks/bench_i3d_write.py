@@ -0,0 +1,69 @@
+"""
+peak memory and time of writing the generated forests, building the whole xmltodict document (`i3d.write`) versus
+streaming the forests into a copy of the source file (`ForestGenerator.write`)
+
+    python -m benchmarks.bench_i3d_write --size 2048 --forests 40
+
+each mode runs in its own process so the peak RSS figures do not influence each other
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks import common, fixtures
+
+MODES = ("document", "stream")
+
+
+def run_mode(mode: str, paths: dict, output: str, density: float) -> dict:
+    from fstools.generate.forests.forestGenerator import ForestGenerator
+    from fstools.util import i3d
+
+    # the document mode rewrites the whole parsed map, so it can't use the lazily read skeleton
+    generator = ForestGenerator(paths["i3d"], "baseTrees", paths["raster"], xml_raster_metadata=paths["xml"],
+                                lazy_i3d=mode != "document")
+    generator.global_density_factor = density
+    if mode == "document":
+        seconds, _ = common.timed(generator.run, seed=1)
+        write_seconds, _ = common.timed(i3d.write, i3d_contents=generator.i3d_data.data, path=output)
+    else:
+        seconds, _ = 0.0, None
+        write_seconds, _ = common.timed(generator.write, output, forests=generator.iter_forests(seed=1))
+    return {"mode": mode, "seconds": round(seconds + write_seconds, 3), "peak_rss_mb": common.peak_rss_mb(),
+            "output_mb": round(os.path.getsize(output) / 1024 / 1024, 1)}
+
+
+def main(size: int, forests: int, density: float):
+    with tempfile.TemporaryDirectory(prefix="fstools_bench_") as directory:
+        paths = fixtures.build_map(directory, size=size, forests=forests)
+        print(f"{'mode':>10} {'time (s)':>9} {'peak RSS (MB)':>14} {'output (MB)':>12}")
+        for mode in MODES:
+            output = os.path.join(directory, f"{mode}.i3d")
+            result = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_i3d_write", "--child", mode, json.dumps(paths), output,
+                 "--density", str(density)],
+                check=True, stdout=subprocess.PIPE, universal_newlines=True
+            )
+            stats = json.loads(result.stdout.strip().splitlines()[-1])
+            print(f"{mode:>10} {stats['seconds']:>9} {stats['peak_rss_mb']:>14.0f} {stats['output_mb']:>12}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=2048)
+    parser.add_argument("--forests", type=int, default=40)
+    parser.add_argument("--density", type=float, default=1.0, help="global density factor")
+    parser.add_argument("--child", nargs=3, metavar=("MODE", "PATHS", "OUTPUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        mode, paths, output = args.child
+        with open(os.devnull, "w") as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            stats = run_mode(mode, json.loads(paths), output, args.density)
+            sys.stdout = stdout
+        print(json.dumps(stats))
+    else:
+        main(args.size, args.forests, args.density)
@@ -0,0 +1,65 @@
+"""
+cold start cost of the fstools entry points, each one is imported in a fresh interpreter with `python -X importtime`
+
+    python -m benchmarks.bench_imports --repeat 5
+
+reports the fastest cumulative import time of every entry point and the top level packages that took the longest
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+ENTRY_POINTS = (
+    "fstools",
+    "fstools.util.i3d",
+    "fstools.util.simple_rasters",
+    "fstools.weights.weights",
+    "fstools.generate.forests.forestGenerator",
+    "fstools.generate.forests.batch",
+)
+
+
+def import_times(module: str) -> dict:
+    """
+    cumulative import time in microseconds of every module imported by `import <module>`
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], check=True,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _self, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def measure(module: str, repeat: int) -> dict:
+    runs = [import_times(module) for _ in range(repeat)]
+    fastest = min(runs, key=lambda times: times[module])
+    packages = {name: value for name, value in fastest.items()
+                if "." not in name and not name.startswith(("fstools", "_"))}
+    heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:3]
+    return {"module": module, "ms": round(fastest[module] / 1000, 1),
+            "heaviest": [(name, round(value / 1000, 1)) for name, value in heaviest]}
+
+
+def main(modules: list, repeat: int, as_json: bool):
+    results = [measure(module, repeat) for module in modules]
+    if as_json:
+        print(json.dumps(results))
+        return
+    print(f"{'entry point':<42} {'import (ms)':>11}  heaviest packages (ms)")
+    for result in results:
+        heaviest = ", ".join(f"{name} {value}" for name, value in result["heaviest"])
+        print(f"{result['module']:<42} {result['ms']:>11}  {heaviest}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=ENTRY_POINTS)
+    parser.add_argument("--repeat", type=int, default=5, help="imports per entry point, the fastest is reported")
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    args = parser.parse_args()
+    main(args.modules, args.repeat, args.json)
@@ -0,0 +1,74 @@
+"""
+compares the grid placement (pixel mask, pruning and thinning) with the poisson placement (blue noise on a spatial
+hash) on a synthetic map, on throughput and on how evenly the trees are spaced
+
+    python -m benchmarks.bench_placement --size 2048 --forests 40 --spacing 4
+
+the spacing is measured by the distance of every tree to its nearest neighbor in the same forest: `close` is the share
+of trees closer than `--close` map units to another tree and `cv` the coefficient of variation of the distances (lower
+is more even, clumps and holes raise it)
+"""
+import argparse
+import contextlib
+import io
+import tempfile
+
+import numpy
+
+from benchmarks import common, fixtures
+from fstools.generate.forests.forestGenerator import ForestGenerator
+
+MODES = ("grid", "poisson")
+
+
+def nearest_distances(points: numpy.ndarray, chunk: int = 256) -> numpy.ndarray:
+    """
+    distance of every point to its nearest other point, brute force a chunk of points at a time
+    """
+    distances = numpy.empty(len(points))
+    for start in range(0, len(points), chunk):
+        block = ((points[start:start + chunk, None, :] - points[None, :, :]) ** 2).sum(axis=-1)
+        block[numpy.arange(len(block)), numpy.arange(start, start + len(block))] = numpy.inf
+        distances[start:start + chunk] = numpy.sqrt(block.min(axis=1))
+    return distances
+
+
+def run_mode(generator: ForestGenerator, mode: str, seed: int) -> tuple:
+    generator.placement = mode
+    with contextlib.redirect_stdout(io.StringIO()):
+        seconds, forests = common.timed(lambda: [forest.collect() for forest in generator.iter_forests(seed=seed)])
+    distances = [nearest_distances(forest.translations[:, [0, 2]]) for forest in forests if len(forest) > 1]
+    return seconds, sum(len(forest) for forest in forests), numpy.concatenate(distances or [numpy.empty(0)])
+
+
+def main(size: int, forests: int, density: float, spacing: float, close: float, seed: int):
+    with tempfile.TemporaryDirectory(prefix="fstools_bench_") as directory:
+        paths = fixtures.build_map(directory, size=size, forests=forests)
+        generator = ForestGenerator(paths["i3d"], "baseTrees", paths["raster"], xml_raster_metadata=paths["xml"],
+                                    cache=False)
+        generator.global_density_factor = density
+        generator.spacing = spacing
+        # builds the label index, so it isn't timed with the first mode
+        generator.label_index.bounds(1)
+        print(f"{'mode':>8} {'trees':>9} {'time (s)':>9} {'trees/s':>10} {'min nn':>7} {'mean nn':>8} {'cv':>6} "
+              f"{'close':>7}")
+        for mode in MODES:
+            seconds, trees, distances = run_mode(generator, mode, seed)
+            if not len(distances):
+                print(f"{mode:>8} {trees:>9} {seconds:>9.2f}")
+                continue
+            print(f"{mode:>8} {trees:>9} {seconds:>9.2f} {trees / seconds:>10.0f} {distances.min():>7.2f} "
+                  f"{distances.mean():>8.2f} {distances.std() / distances.mean():>6.3f} "
+                  f"{numpy.mean(distances < close):>7.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=2048)
+    parser.add_argument("--forests", type=int, default=40)
+    parser.add_argument("--density", type=float, default=1.0, help="global density factor")
+    parser.add_argument("--spacing", type=float, default=4.0, help="minimum tree distance of the poisson placement")
+    parser.add_argument("--close", type=float, default=2.0, help="nearest neighbor distance counted as too close")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    main(args.size, args.forests, args.density, args.spacing, args.close, args.seed)
@@ -0,0 +1,40 @@
+"""
+compares the array based neighbor pruning against the original per cell loop
+
+    python -m benchmarks.bench_prune --sizes 1024 4096 8192
+
+the original loop is only timed in full up to `--legacy-limit` pixels, above that it is timed on a strip of rows and
+scaled up to the full raster (marked with `~`)
+"""
+import argparse
+
+import numpy
+
+from benchmarks import common
+from fstools.generate.forests import pruning
+from tests.pruning_reference import legacy_prune_neighbors, synthetic_aoi
+
+
+def main(sizes, distance=2, legacy_limit=1024, strip=64):
+    print(f"{'size':>6} {'array (s)':>10} {'loop (s)':>12} {'speedup':>9}")
+    for size in sizes:
+        aoi = synthetic_aoi(size)
+        array_time, keep = common.timed(pruning.prune_neighbors, aoi, distance=distance)
+        if size <= legacy_limit:
+            loop_time, legacy = common.timed(legacy_prune_neighbors, aoi, distance=distance)
+            assert numpy.array_equal(numpy.asarray(legacy) > 0, keep), f"mismatch at {size}"
+            loop_label = f"{loop_time:.2f}"
+        else:
+            loop_time, _ = common.timed(legacy_prune_neighbors, aoi[:strip], distance=distance)
+            loop_time *= size / strip
+            loop_label = f"~{loop_time:.2f}"
+        print(f"{size:>6} {array_time:>10.3f} {loop_label:>12} {loop_time / array_time:>8.0f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1024, 4096, 8192])
+    parser.add_argument("--distance", type=int, default=2)
+    parser.add_argument("--legacy-limit", type=int, default=1024)
+    args = parser.parse_args()
+    main(args.sizes, distance=args.distance, legacy_limit=args.legacy_limit)
@@ -0,0 +1,23 @@
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def peak_rss_mb() -> float:
+    """
+    peak resident memory of this process in MB (None where the resource module is not available)
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
@@ -0,0 +1,157 @@
+"""
+builds a synthetic map (i3d, 16 bit DEM, forest infoLayer png, forests.xml and optionally a forests shapefile) for the
+benchmarks
+
+    python -m benchmarks.fixtures <directory> --size 2048 --forests 50 --shp
+"""
+import argparse
+import os
+
+import imageio
+import numpy
+
+SPECIES = {"Pine": 5, "Spruce": 5, "Maple": 1, "Birch": 4}
+
+
+def _tree_templates(species: dict) -> str:
+    groups = []
+    node_id = 1000
+    for name, stages in species.items():
+        children = "".join(
+            f'<TransformGroup name="{name.lower()}_stage{stage}" nodeId="{node_id + stage}">'
+            f'<Shape name="{name.lower()}_stage{stage}_LOD0" shapeId="{node_id + stage}" nodeId="{node_id + 50 + stage}"/>'
+            f'</TransformGroup>'
+            for stage in range(1, stages + 1)
+        )
+        groups.append(f'      <TransformGroup name="base{name}" nodeId="{node_id}">{children}</TransformGroup>')
+        node_id += 100
+    return "\n".join(groups)
+
+
+def label_raster(size: int, forests: int, rng: numpy.random.Generator) -> numpy.ndarray:
+    """
+    paints `forests` overlapping elliptical forests (values 1..forests) onto an empty raster
+    """
+    raster = numpy.zeros((size, size), dtype=numpy.uint8 if forests < 256 else numpy.uint16)
+    rows, columns = numpy.ogrid[:size, :size]
+    radius = max(4, int(size / numpy.sqrt(forests) / 2))
+    for label in range(1, forests + 1):
+        center_row, center_column = rng.integers(0, size, 2)
+        height, width = rng.integers(radius // 2, radius * 2, 2)
+        top, bottom = max(0, center_row - height), min(size, center_row + height + 1)
+        left, right = max(0, center_column - width), min(size, center_column + width + 1)
+        ellipse = ((rows[top:bottom] - center_row) / height) ** 2 + ((columns[:, left:right] - center_column) / width) ** 2
+        raster[top:bottom, left:right][ellipse <= 1] = label
+    return raster
+
+
+def dem_raster(size: int, rng: numpy.random.Generator, band_rows: int = 1024) -> numpy.ndarray:
+    """
+    rolling hills with some noise, built a band of rows at a time so large maps don't need a float copy
+    """
+    dem = numpy.empty((size + 1, size + 1), dtype=numpy.uint16)
+    columns = numpy.cos(numpy.linspace(0, 4, size + 1))
+    rows = numpy.sin(numpy.linspace(0, 6, size + 1))
+    for top in range(0, size + 1, band_rows):
+        bottom = min(top + band_rows, size + 1)
+        hills = numpy.add.outer(rows[top:bottom], columns)
+        noise = rng.integers(0, 200, (bottom - top, size + 1))
+        dem[top:bottom] = (hills + 2) * 8000 + noise
+    return dem
+
+
+def forest_fields(forests: int, species: dict) -> list:
+    """
+    the attributes of every forest, as written to forests.xml and the shapefile
+    """
+    weight = round(1 / len(species), 4)
+    return [dict([("id", label), ("minSize", 1), ("maxSize", 1 + label % 4), ("densMult", 0.6)] +
+                 [(f"wgt{name}", weight) for name in species])
+            for label in range(1, forests + 1)]
+
+
+def write_shapefile(path: str, raster: numpy.ndarray, fields: list):
+    """
+    a polygon (the bounding box of its pixels) with the attributes of every forest
+    """
+    import shapefile
+
+    writer = shapefile.Writer(path, shapeType=shapefile.POLYGON)
+    for name, value in fields[0].items():
+        writer.field(name, "N", 10, 4 if isinstance(value, float) else 0)
+    for values in fields:
+        rows, columns = numpy.nonzero(raster == values["id"])
+        if len(rows):
+            top, bottom, left, right = rows.min(), rows.max() + 1, columns.min(), columns.max() + 1
+        else:
+            top = bottom = left = right = 0
+        writer.poly([[[left, -top], [right, -top], [right, -bottom], [left, -bottom], [left, -top]]])
+        writer.record(**values)
+    writer.close()
+
+
+def build_map(directory: str, size: int = 1024, forests: int = 10, seed: int = 0, species: dict = None,
+              shp: bool = False) -> dict:
+    """
+    writes a synthetic map into `directory`
+    :param shp: also write the forests as a shapefile (needs pyshp)
+    :return: dict with the paths of the `i3d`, `dem`, `raster` and `xml` files (and `shp`)
+    """
+    species = species or SPECIES
+    rng = numpy.random.default_rng(seed)
+    data_dir = os.path.join(directory, "maps", "data")
+    os.makedirs(data_dir, exist_ok=True)
+    paths = {
+        "i3d": os.path.join(directory, "maps", "map.i3d"),
+        "dem": os.path.join(data_dir, "map_dem.png"),
+        "raster": os.path.join(data_dir, "forests.png"),
+        "xml": os.path.join(directory, "forests.xml"),
+    }
+    raster = label_raster(size, forests, rng)
+    imageio.imwrite(paths["raster"], raster)
+    imageio.imwrite(paths["dem"], dem_raster(size, rng))
+    with open(paths["i3d"], "w") as fo:
+        fo.write(f'''<?xml version="1.0" encoding="iso-8859-1"?>
+<i3D name="benchmark" version="1.6">
+  <Asset>
+    <Export program="fstools benchmarks" version="1"/>
+  </Asset>
+  <Files>
+    <File fileId="1" filename="data/map_dem.png"/>
+    <File fileId="2" filename="data/forests.png"/>
+  </Files>
+  <Scene>
+    <TerrainTransformGroup name="terrain" heightScale="255" unitsPerPixel="2" heightMapId="1" nodeId="10">
+      <Layers>
+        <InfoLayer name="autoForestLayer" fileId="2" numChannels="8"/>
+      </Layers>
+    </TerrainTransformGroup>
+    <TransformGroup name="baseTrees" nodeId="20">
+{_tree_templates(species)}
+    </TransformGroup>
+    <TransformGroup name="autoForests" nodeId="30"/>
+  </Scene>
+</i3D>
+''')
+    fields = forest_fields(forests, species)
+    with open(paths["xml"], "w") as fo:
+        fo.write("<forests>\n")
+        for values in fields:
+            attributes = " ".join(f'{name}="{value}"' for name, value in values.items())
+            fo.write(f'\t<forest {attributes} />\n')
+        fo.write("</forests>\n")
+    if shp:
+        paths["shp"] = os.path.join(directory, "forests.shp")
+        write_shapefile(paths["shp"], raster, fields)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory")
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--forests", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--shp", action="store_true", help="also write a forests shapefile")
+    args = parser.parse_args()
+    print(build_map(args.directory, size=args.size, forests=args.forests, seed=args.seed, shp=args.shp))
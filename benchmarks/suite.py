@@ -0,0 +1,217 @@
+"""
+end to end benchmarks of the forest generator on synthetic maps, with baselines to compare commits
+
+    python -m benchmarks.suite --preset default --save before
+    python -m benchmarks.suite --preset default --compare before
+
+every case (map size, number of forests, xml or shp records) runs in its own process and reports the throughput
+(trees/s), the peak RSS, the time per pipeline stage (see `Instrumentation`) and the time of the hot paths:
+`prune_neighbors` on the whole raster, `generateMask` and `generate` of the largest forest, `map_to_key` over the
+generated i3d and `i3d.read`/`i3d.write` of it. the maps are kept in `--fixtures-dir` so they are only built once
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+from benchmarks import common, fixtures
+
+PRESETS = {
+    "small": [(1024, 10)],
+    "default": [(1024, 10), (2048, 50), (4096, 200)],
+    "large": [(8192, 500), (16384, 1000)],
+}
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+# metrics where a higher value is better, for every other one lower is better
+HIGHER_IS_BETTER = ("trees_per_s",)
+
+
+def case_name(case: dict) -> str:
+    return f"{case['size']}px-{case['forests']}f-{case['source']}"
+
+
+def fixture(directory: str, size: int, forests: int) -> dict:
+    """
+    the paths of the synthetic map of a size and number of forests, built when it doesn't exist yet
+    """
+    root = os.path.join(directory, f"map_{size}_{forests}")
+    marker = os.path.join(root, "paths.json")
+    if not os.path.exists(marker):
+        paths = fixtures.build_map(root, size=size, forests=forests, shp=True)
+        with open(marker, "w") as fo:
+            json.dump(paths, fo)
+    with open(marker, "r") as fi:
+        return json.load(fi)
+
+
+def _hot_paths(generator, output: str, seed: int) -> dict:
+    from fstools.generate.forests import pruning
+    from fstools.util import i3d
+
+    times = {}
+    occupied = generator.raster > 0
+    times["prune_neighbors"], _ = common.timed(pruning.prune_neighbors, occupied, distance=2)
+    records = generator.read_records()
+    largest = max(records, key=lambda record: generator.label_index.count(record.record.id))
+    species = generator.catalogue.species
+    weights = generator.forest_weights(largest)
+    times["generateMask"], _ = common.timed(generator.generateMask, largest, seed, species=species,
+                                            weighting=weights)
+    times["generate"], _ = common.timed(generator.generate, largest, seed=seed)
+    times["i3d.read"], document = common.timed(i3d.read, output)
+    found = []
+    times["map_to_key"], _ = common.timed(i3d.map_to_key, document, "@nodeId", found.append)
+    times["i3d.write"], _ = common.timed(i3d.write, document, output + ".copy.i3d")
+    os.remove(output + ".copy.i3d")
+    return times
+
+
+def run_case(case: dict, paths: dict, seed: int) -> dict:
+    """
+    generates and writes every forest of a map, then times the hot paths on it
+    """
+    from fstools.generate.forests.forestGenerator import ForestGenerator
+    from fstools.generate.forests.instrumentation import Instrumentation
+
+    instrumentation = Instrumentation(quiet=True)
+    shp = paths["shp"] if case["source"] == "shp" else None
+    xml = paths["xml"] if case["source"] == "xml" else None
+    with tempfile.TemporaryDirectory(prefix="fstools_suite_") as directory:
+        output = os.path.join(directory, "map.i3d")
+
+        def generate():
+            generator = ForestGenerator(paths["i3d"], "baseTrees", paths["raster"], shp, xml_raster_metadata=xml,
+                                        cache=False, instrumentation=instrumentation)
+            generator.write(output, forests=generator.iter_forests(seed=seed))
+            return generator
+
+        seconds, generator = common.timed(generate)
+        report = instrumentation.finish()
+        trees = report.counters.get("trees", 0)
+        peak_mb = common.peak_rss_mb()
+        hot_paths = _hot_paths(generator, output, seed)
+    return {"case": case_name(case), "trees": trees, "seconds": round(seconds, 3),
+            "trees_per_s": round(trees / seconds, 1) if seconds else None,
+            "peak_mb": round(peak_mb, 1) if peak_mb is not None else None,
+            "stages": {name: round(value, 4) for name, value in report.stages.items()},
+            "hot_paths": {name: round(value, 4) for name, value in hot_paths.items()}}
+
+
+def _child(case: dict, paths: dict, seed: int) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.suite", "--child", json.dumps(case), json.dumps(paths), "--seed", str(seed)],
+        check=True, stdout=subprocess.PIPE, universal_newlines=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _commit() -> str:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, universal_newlines=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def flatten(result: dict) -> dict:
+    """
+    the comparable metrics of a case result, stages and hot paths prefixed with their group
+    """
+    metrics = {name: result[name] for name in ("seconds", "trees_per_s", "peak_mb") if result.get(name) is not None}
+    metrics.update({f"stage.{name}": value for name, value in result["stages"].items()})
+    metrics.update({f"hot.{name}": value for name, value in result["hot_paths"].items()})
+    return metrics
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """
+    prints the change of every metric of the cases both runs have
+    :param threshold: percentage a metric may get worse before it is reported as a regression
+    :return: (case, metric, change in percent) of the regressions
+    """
+    regressions = []
+    baseline_cases = {result["case"]: result for result in baseline["cases"]}
+    print(f"{'case':<22} {'metric':<24} {'baseline':>11} {'current':>11} {'change':>8}")
+    for result in current["cases"]:
+        if result["case"] not in baseline_cases:
+            continue
+        before = flatten(baseline_cases[result["case"]])
+        for metric, value in flatten(result).items():
+            if metric not in before or not before[metric]:
+                continue
+            change = (value - before[metric]) / before[metric] * 100
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            # stages below 10 ms are too noisy to flag
+            regressed = worse > threshold and max(value, before[metric]) >= 0.01
+            if regressed:
+                regressions.append((result["case"], metric, round(change, 1)))
+            print(f"{result['case']:<22} {metric:<24} {before[metric]:>11} {value:>11} {change:>+7.1f}%"
+                  f"{' !' if regressed else ''}")
+    return regressions
+
+
+def baseline_path(name: str, directory: str = BASELINE_DIR) -> str:
+    return name if name.endswith(".json") else os.path.join(directory, f"{name}.json")
+
+
+def main(args: list = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="default")
+    parser.add_argument("--case", nargs=2, type=int, action="append", metavar=("SIZE", "FORESTS"),
+                        help="run this map size and number of forests instead of the preset (repeatable)")
+    parser.add_argument("--sources", nargs="+", choices=("xml", "shp"), default=["xml", "shp"])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--fixtures-dir", default=os.path.join(tempfile.gettempdir(), "fstools_fixtures"))
+    parser.add_argument("--save", default=None, help="store the results as a baseline (name or .json path)")
+    parser.add_argument("--compare", default=None, help="compare the results with a saved baseline")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    parser.add_argument("--child", nargs=2, metavar=("CASE", "PATHS"), help=argparse.SUPPRESS)
+    options = parser.parse_args(args)
+    if options.child:
+        case, paths = (json.loads(value) for value in options.child)
+        with open(os.devnull, "w") as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            result = run_case(case, paths, options.seed)
+            sys.stdout = stdout
+        print(json.dumps(result))
+        return 0
+
+    import numpy
+
+    cases = [{"size": size, "forests": forests, "source": source}
+             for size, forests in options.case or PRESETS[options.preset] for source in options.sources]
+    results = {"commit": _commit(), "date": datetime.datetime.now().isoformat(timespec="seconds"),
+               "python": platform.python_version(), "numpy": numpy.__version__, "machine": platform.machine(),
+               "seed": options.seed, "cases": []}
+    print(f"{'case':<22} {'trees':>9} {'time (s)':>9} {'trees/s':>10} {'peak MB':>8}  stages (s)")
+    for case in cases:
+        result = _child(case, fixture(options.fixtures_dir, case["size"], case["forests"]), options.seed)
+        results["cases"].append(result)
+        stages = ", ".join(f"{name} {value:.2f}" for name, value in result["stages"].items())
+        print(f"{result['case']:<22} {result['trees']:>9} {result['seconds']:>9.2f} {result['trees_per_s']:>10.0f} "
+              f"{result['peak_mb'] or 0:>8.0f}  {stages}")
+    if options.save:
+        path = baseline_path(options.save)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as fo:
+            json.dump(results, fo, indent=2)
+        print(f"saved {path}")
+    if options.compare:
+        with open(baseline_path(options.compare), "r") as fi:
+            baseline = json.load(fi)
+        print(f"\ncompared with {baseline.get('commit')} ({baseline.get('date')})")
+        regressions = compare(baseline, results, options.threshold)
+        if regressions:
+            print(f"{len(regressions)} metrics regressed by more than {options.threshold}%")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
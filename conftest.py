@@ -0,0 +1,2 @@
+# puts the repository root on sys.path, so the tests can import `fstools`, `benchmarks` and `tests` when run with a
+# plain `pytest` as well as with `python -m pytest`
@@ -1,7 +1,17 @@
-import gettext
 import os
 
 __current_dir = os.path.abspath(os.path.dirname(__file__))
-gettext.bindtextdomain('myapplication', os.path.join(__current_dir, "locale"))
-gettext.textdomain('myapplication')
-_ = gettext.gettext
+__gettext = None
+
+
+def _(message: str) -> str:
+    """
+    translates a message, gettext is only set up once the first message is translated so importing fstools stays cheap
+    """
+    global __gettext
+    if __gettext is None:
+        import gettext
+        gettext.bindtextdomain('myapplication', os.path.join(__current_dir, "locale"))
+        gettext.textdomain('myapplication')
+        __gettext = gettext.gettext
+    return __gettext(message)
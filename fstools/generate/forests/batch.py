@@ -0,0 +1,245 @@
+"""
+generates the forests of several maps from a manifest, each job in its own process:
+
+    python -m fstools.generate.forests.batch manifest.toml --workers 2 --memory-limit 6000
+
+a manifest (TOML or JSON) holds optional `defaults` for every job and a list of `jobs`, relative paths are relative to
+the manifest:
+
+    workers = 2
+    memory_limit_mb = 6000
+
+    [defaults]
+    tree_source = "baseTrees"
+    seed = 1
+
+    [[jobs]]
+    name = "sussex"
+    i3d = "Sussex/maps/mapNB.i3d"
+    raster = "Sussex/maps/mapNB1/forests.png"
+    xml = "Sussex/xml/forests.xml"
+    density = 0.3
+
+    [[jobs]]
+    name = "sussex-blue-noise"
+    i3d = "Sussex/maps/mapNB.i3d"
+    raster = "Sussex/maps/mapNB1/forests.png"
+    xml = "Sussex/xml/forests.xml"
+    output = "Sussex/maps/mapNB_poisson.i3d"
+    placement = "poisson"
+    spacing = {default = 4.0, maple = 6.0, pine = {1 = 2.5, 2 = 3.0}}
+
+the decoded rasters and the parsed i3d are kept in a disk cache (`cache_dir`, the user cache directory by
+default), set `cache = false` on a job to read them from the map files every time. `forest_cache_dir` keeps the
+generated forests of jobs with a `seed` and only regenerates the ones whose inputs changed
+"""
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import sys
+import time
+from multiprocessing import connection
+
+from fstools.generate.forests.forestGenerator import ForestGenerator
+from fstools.generate.forests.instrumentation import Instrumentation, JsonLogSink
+from fstools.i18n import _
+from fstools.util.disk_cache import DiskCache
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+JOB_FIELDS = {
+    "name": None,
+    "i3d": None,
+    "raster": None,
+    "shp": None,
+    "xml": None,
+    "tree_source": "baseTrees",
+    "seed": None,
+    "density": None,
+    "placement": "grid",
+    "spacing": 4.0,
+    "output": None,
+    "workers": 1,
+    "tile_rows": None,
+    "cache": True,
+    "cache_dir": None,
+    "forest_cache_dir": None,
+    "quiet": False,
+    "stats_log": None,
+}
+PATH_FIELDS = ("i3d", "raster", "shp", "xml", "output", "cache_dir", "forest_cache_dir", "stats_log")
+
+Job = collections.namedtuple("Job", list(JOB_FIELDS))
+JobResult = collections.namedtuple("JobResult", ["name", "error", "load_time", "generate_time", "total_time",
+                                                 "peak_mb"])
+
+
+def _load_manifest(path: str) -> dict:
+    if os.path.splitext(path)[1].lower() == ".json":
+        with open(path, "r") as fi:
+            return json.load(fi)
+    try:
+        import tomllib
+    except ImportError:
+        try:
+            import tomli as tomllib
+        except ImportError:
+            raise AssertionError(_("reading TOML manifests needs python 3.11 or the tomli package, use JSON instead"))
+    with open(path, "rb") as fi:
+        return tomllib.load(fi)
+
+
+def read_manifest(path: str) -> tuple:
+    """
+    reads the jobs of a TOML/JSON manifest
+    :return: the manifest's top level settings and a list of Job
+    """
+    manifest = _load_manifest(path)
+    base = os.path.dirname(os.path.abspath(path))
+    defaults = manifest.get("defaults", {})
+    jobs = []
+    for number, entry in enumerate(manifest.get("jobs", []), 1):
+        values = dict(JOB_FIELDS, **defaults)
+        values.update(entry)
+        unknown = set(values) - set(JOB_FIELDS)
+        assert not unknown, _("unknown job settings: {}").format(", ".join(sorted(unknown)))
+        for field in PATH_FIELDS:
+            if values[field] is not None:
+                values[field] = os.path.join(base, os.path.expanduser(values[field]))
+        assert values["i3d"] and values["raster"], _("job #{} needs an i3d and a raster").format(number)
+        assert values["shp"] or values["xml"], _("job #{} needs a shp or xml file").format(number)
+        values["name"] = str(values["name"] or os.path.splitext(os.path.basename(values["i3d"]))[0])
+        values["output"] = values["output"] or values["i3d"]
+        jobs.append(Job(**values))
+    settings = {key: value for key, value in manifest.items() if key not in ("defaults", "jobs")}
+    return settings, jobs
+
+
+def _peak_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / pow(2, 20) if sys.platform == "darwin" else peak / pow(2, 10)
+
+
+def _limit_memory(memory_limit_mb: int):
+    if memory_limit_mb and resource is not None:
+        limit = int(memory_limit_mb * pow(2, 20))
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def run_job(job: Job) -> JobResult:
+    """
+    generates and writes the forests of a single job
+    """
+    start = time.perf_counter()
+    load_time = generate_time = None
+    try:
+        instrumentation = Instrumentation(sinks=[JsonLogSink(job.stats_log)] if job.stats_log else [],
+                                          quiet=job.quiet)
+        generator = ForestGenerator(job.i3d, job.tree_source, job.raster, job.shp, xml_raster_metadata=job.xml,
+                                    cache=DiskCache(job.cache_dir) if job.cache else False,
+                                    instrumentation=instrumentation)
+        if job.density is not None:
+            generator.global_density_factor = float(job.density)
+        generator.placement = job.placement
+        generator.spacing = job.spacing
+        load_time = time.perf_counter() - start
+        forests = generator.iter_forests(seed=job.seed, workers=job.workers, tile_rows=job.tile_rows,
+                                         cache_dir=job.forest_cache_dir)
+        generator.write(job.output, forests=forests)
+        instrumentation.finish()
+        generate_time = time.perf_counter() - start - load_time
+        error = None
+    except Exception as exc:
+        error = f"{type(exc).__name__}: {exc}"
+    return JobResult(name=job.name, error=error, load_time=load_time, generate_time=generate_time,
+                     total_time=time.perf_counter() - start, peak_mb=_peak_mb())
+
+
+def _job_process(job: Job, memory_limit_mb: int, log_dir: str, sender):
+    _limit_memory(memory_limit_mb)
+    if log_dir:
+        sys.stdout = sys.stderr = open(os.path.join(log_dir, f"{job.name}.log"), "w", buffering=1)
+    sender.send(run_job(job))
+    sender.close()
+
+
+def run_batch(jobs: list, workers: int = 1, memory_limit_mb: int = None, log_dir: str = None) -> list:
+    """
+    runs every job in a fresh process, at most `workers` at a time, so memory is given back after every job
+    :param jobs: list of Job
+    :param workers: number of jobs to run at once
+    :param memory_limit_mb: address space limit of each job process (unix only), memory maps count towards it
+    :param log_dir: write the output of each job to `<log_dir>/<name>.log` instead of the console
+    :return: a JobResult per job, in job order
+    """
+    if memory_limit_mb and resource is None:
+        print(_("memory limits are not supported on this platform, running without"))
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+    context = multiprocessing.get_context()
+    pending = list(enumerate(jobs))
+    running = {}
+    results = {}
+    while pending or running:
+        while pending and len(running) < max(1, workers):
+            index, job = pending.pop(0)
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=_job_process, args=(job, memory_limit_mb, log_dir, sender),
+                                      name=f"fstools-{job.name}")
+            process.start()
+            sender.close()
+            running[process.sentinel] = (index, job, process, receiver)
+            print(_("started {}").format(job.name))
+        for sentinel in connection.wait(list(running)):
+            index, job, process, receiver = running.pop(sentinel)
+            process.join()
+            if receiver.poll():
+                results[index] = receiver.recv()
+            else:
+                error = _("process exited with code {}").format(process.exitcode)
+                results[index] = JobResult(job.name, error, None, None, None, None)
+            receiver.close()
+            print(_("finished {}").format(job.name))
+    return [results[index] for index in range(len(jobs))]
+
+
+def _seconds(value) -> str:
+    return "-" if value is None else f"{value:.1f}"
+
+
+def print_summary(results: list):
+    print(f"{_('job'):<24} {_('status'):<8} {_('load s'):>8} {_('generate s'):>11} {_('total s'):>8} {_('peak MB'):>8}")
+    for result in results:
+        status = _("failed") if result.error else _("ok")
+        print(f"{result.name:<24} {status:<8} {_seconds(result.load_time):>8} {_seconds(result.generate_time):>11} "
+              f"{_seconds(result.total_time):>8} {_seconds(result.peak_mb):>8}")
+    for result in results:
+        if result.error:
+            print(f"{result.name}: {result.error}")
+
+
+def main(args: list = None) -> int:
+    parser = argparse.ArgumentParser(description=_("generate the forests of every job in a TOML/JSON manifest"))
+    parser.add_argument("manifest", help=_("the jobs to run"))
+    parser.add_argument("--workers", type=int, default=None, help=_("jobs to run at once (manifest `workers`, 1)"))
+    parser.add_argument("--memory-limit", type=int, default=None,
+                        help=_("memory limit of each job in MB (manifest `memory_limit_mb`), unix only"))
+    parser.add_argument("--log-dir", default=None, help=_("write each job's output to <log-dir>/<name>.log"))
+    options = parser.parse_args(args)
+    settings, jobs = read_manifest(options.manifest)
+    workers = options.workers or settings.get("workers", 1)
+    memory_limit_mb = options.memory_limit or settings.get("memory_limit_mb")
+    results = run_batch(jobs, workers=workers, memory_limit_mb=memory_limit_mb, log_dir=options.log_dir)
+    print_summary(results)
+    return 1 if any(result.error for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
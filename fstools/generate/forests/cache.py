@@ -0,0 +1,54 @@
+import os
+
+import numpy
+
+from fstools.generate.forests.instances import ForestInstances
+from fstools.util.disk_cache import DiskCache
+
+# bump when a change to the generation gives different forests for the same inputs
+FOREST_CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = pow(2, 30)
+
+
+class ForestCache:
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        generated forests stored under the hash of everything they depend on (see `ForestGenerator.forest_key`), so a
+        run only has to generate the forests whose record, pixels, terrain or tree templates changed. node ids are
+        stored relative to the forest so a forest can be reused under another name and id range. the least recently
+        used forests are removed once the directory grows past `max_bytes`
+        :param directory: where the forests are stored, one `<key>.npz` per forest
+        :param max_bytes: size the directory is trimmed to after every store
+        """
+        self.directory = os.fspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        # only used for its least recently used eviction of the directory's files
+        self._files = DiskCache(self.directory, max_bytes=max_bytes)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def load(self, key: str, name: str, node_id: int) -> ForestInstances:
+        path = self._path(key)
+        # the modification time orders the forests for eviction
+        os.utime(path)
+        with numpy.load(path) as stored:
+            return ForestInstances(name=name, node_id=node_id, translations=stored['translations'],
+                                   rotations=stored['rotations'], species=stored['species'], stages=stored['stages'],
+                                   ids=stored['ids'] + node_id)
+
+    def store(self, key: str, forest: ForestInstances):
+        path = self._path(key)
+        temporary = path + ".tmp"
+        try:
+            with open(temporary, "wb") as fo:
+                numpy.savez(fo, translations=forest.translations, rotations=forest.rotations, species=forest.species,
+                            stages=forest.stages, ids=forest.ids - forest.node_id)
+            os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        self._files.evict(keep=(path,))
@@ -0,0 +1,126 @@
+import collections
+import hashlib
+import json
+
+import numpy
+
+from fstools.i18n import _
+from fstools.util.i3d import TransformGroup
+
+
+class Stage(collections.namedtuple("Stage", ["age", "name", "template"])):
+    __slots__ = ()
+
+    def node(self, translation: str, rotation: str, node_id: int) -> collections.OrderedDict:
+        """
+        a placed tree, only the attributes are new, the children are shared with the template
+        """
+        transform = TransformGroup()
+        tree = self.template.copy()
+        tree[transform.translation] = translation
+        tree[transform.rotation] = rotation
+        tree[transform.id] = str(node_id)
+        return tree
+
+
+class Species:
+    __slots__ = ("name", "key", "weight_field", "single", "stages")
+
+    def __init__(self, node: dict, prefix: str = 'base'):
+        """
+        the stages of a `base<Name>` transform group, ages are read from the `<name>_stage<age>` children
+        :param node: the species transform group
+        :param prefix: prefix of the species transform group names
+        """
+        transform = TransformGroup()
+        self.name = node[transform.name]
+        stripped = self.name.lstrip(prefix)
+        self.key = stripped.lower()
+        self.weight_field = f"wgt{stripped}"
+        children = node.get(transform.default_label)
+        # a single tree in the group isn't a list (maple), it is used whatever the record's min/max size
+        self.single = isinstance(children, dict)
+        if self.single:
+            children = [children]
+        self.stages = [self._stage(child) for child in children or []]
+
+    def _stage(self, child: dict) -> Stage:
+        transform = TransformGroup()
+        name = child[transform.name]
+        age = name.lstrip(f"{self.key}_stage")
+        if age.isdigit():
+            age = int(age)
+        else:
+            assert self.single, _("can't read the age of {}, expected <name>_stage<age>").format(name)
+        return Stage(age=age, name=name, template=child)
+
+    def permitted(self, min_size: int, max_size: int) -> list:
+        """
+        indices of the stages allowed by a record's min/max size
+        """
+        if self.single:
+            return list(range(len(self.stages)))
+        return [i for i, stage in enumerate(self.stages) if min_size <= stage.age <= max_size]
+
+
+class StageTable:
+    def __init__(self, species: list, min_size: int, max_size: int):
+        """
+        the stages of every species permitted by a record's min/max size as a lookup table, so the stages of a whole
+        forest are picked with a single indexing operation. a single stage species (maple) always has its stage
+        :param species: the catalogue's species
+        """
+        permitted = [tree.permitted(min_size, max_size) for tree in species]
+        self.counts = numpy.array([len(stages) for stages in permitted], dtype=numpy.int64)
+        self.table = numpy.zeros((len(species), max([1] + self.counts.tolist())), dtype=numpy.int16)
+        for index, stages in enumerate(permitted):
+            self.table[index, :len(stages)] = stages
+
+    @property
+    def complete(self) -> bool:
+        """
+        every species has at least one permitted stage
+        """
+        return bool(self.counts.all())
+
+    def available(self, species: numpy.ndarray) -> numpy.ndarray:
+        """
+        mask of the trees whose species has a permitted stage
+        """
+        return self.counts[species] > 0
+
+    def pick(self, species: numpy.ndarray, uniforms: numpy.ndarray) -> numpy.ndarray:
+        """
+        a permitted stage index per tree, drawn uniformly with the given [0, 1) uniforms
+        :param species: species index of each tree, each must be `available`
+        """
+        counts = self.counts[species]
+        return self.table[species, numpy.floor(uniforms * counts).astype(numpy.int64)]
+
+
+class TreeCatalogue:
+    def __init__(self, source: dict, prefix: str = 'base'):
+        """
+        compiles the tree templates of the tree source transform group (baseTrees) once: species -> stage -> template
+        :param source: the tree source transform group
+        :param prefix: prefix of the species transform group names
+        """
+        transform = TransformGroup()
+        children = source.get(transform.default_label)
+        if isinstance(children, dict):
+            children = [children]
+        self.species = [Species(node, prefix=prefix) for node in children or []]
+        # identifies the templates, cached forests are only valid for the templates they were generated from
+        self.digest = hashlib.sha256(json.dumps([prefix, source]).encode("utf-8")).hexdigest()
+
+    def stage_table(self, min_size: int, max_size: int) -> StageTable:
+        return StageTable(self.species, min_size, max_size)
+
+    def __len__(self) -> int:
+        return len(self.species)
+
+    def __iter__(self):
+        return iter(self.species)
+
+    def __getitem__(self, item) -> Species:
+        return self.species[item]
@@ -1,24 +1,35 @@
-import collections
+import copy
+import hashlib
+import itertools
 import json
-import math
 import os
-import random
-from contextlib import suppress
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import numpy
-import shapefile
 
+from fstools.generate.forests import parallel, placement, poisson, pruning
+from fstools.generate.forests.cache import FOREST_CACHE_VERSION, ForestCache
+from fstools.generate.forests.catalogue import TreeCatalogue
+from fstools.generate.forests.instances import THINNING_CHUNK, ForestInstances, ForestTiles, thinning_mask
+from fstools.generate.forests.instrumentation import Instrumentation
+from fstools.generate.forests.labels import LabelIndex
+from fstools.generate.forests.streams import OCCUPANCY, POISSON, SPECIES, THINNING_PERCENT, RandomStreams
 from fstools.generate.forests.xml_parser import XmlForests
 from fstools.i18n import _
 from fstools.util import i3d
-from fstools.util import simple_rasters
-from fstools.util.i3d import TransformGroup, get_for_key
-from fstools.util.shapeutil import shape_components, shape_readers
+from fstools.util import disk_cache, shared_arrays, simple_rasters
+from fstools.util.shapeutil import iter_dbf_records, shape_components, shape_readers
+
+if TYPE_CHECKING:
+    import shapefile
+
+CANDIDATE_DTYPE = numpy.dtype([('x', numpy.int32), ('y', numpy.int32), ('species', numpy.int16)])
 
 
 class ForestGenerator:
-    def __init__(self, i3d_fn: str, tree_source: str, raster_source: Path, shape: str = None, xml_raster_metadata: str = None):
+    def __init__(self, i3d_fn: str, tree_source: str, raster_source: Path, shape: str = None, xml_raster_metadata: str = None,
+                 lazy_i3d: bool = True, cache=True, instrumentation: Instrumentation = None):
         """
         takes a i3d file and creates forests automatically based on a combination of either shp or xml data with a
         raster layer input to specify locations of the forests
@@ -27,41 +38,103 @@ class ForestGenerator:
         :param raster_source: a png or tiff that matches the DEM file in the i3d file
         :param shape: a shapefile that the raster_source that was exported from a GIS app with corresponding metadata
         :param xml_raster_metadata: a xml file that corresponds with the infoLayer png (raster_source)
+        :param lazy_i3d: only parse the parts of the i3d the generator uses (terrain, files, tree source and
+        autoForests), the rest is copied unchanged by `write`. turn off to work with the full document, e.g. to
+        write `i3d_data.data` after `run` with `i3d.write`, which refuses the partial document
+        :param cache: a DiskCache (True for the default one) that keeps the parsed i3d with its index and the
+        decoded forest raster and DEM between runs, the rasters are memory mapped from it. False decodes and parses
+        everything on every run
+        :param instrumentation: collects the stage timings and counters and handles the progress output, see
+        `Instrumentation` (quiet mode, sinks, profiling)
         """
         super().__init__()
-        self.i3d_data = i3d.TransformGroup(file=i3d_fn)
-        self.terrain = i3d.Terrain(i3d=self.i3d_data.data)
-        self.tree_source = tree_source
+        self.instrumentation = instrumentation or Instrumentation()
+        self.instrumentation.start()
+        with self.instrumentation.stage("load"):
+            self._load(i3d_fn, tree_source, raster_source, lazy_i3d, cache)
         self.shp = shape
         self.xml_raster_metadata = xml_raster_metadata
-        self.raster = simple_rasters.read_img(raster_source)
         self.global_density_factor = 0.3  # 0.6 is good for a realistic 'feel' but it's not great for gameplay
-        self.dem_files = self.terrain.get_dem_files()
-        assert self.dem_files, _("DEM not found in i3d")
+        # "grid" (pixel mask, pruning and thinning) or "poisson" (blue noise with `spacing` between the trees)
+        self.placement = "grid"
+        # minimum distance between trees in the poisson placement, see `poisson.distance_table`
+        self.spacing = 4.0
+        self.seed = None
         self.__shp_records = None
         self.__shp_fields = None
         self.__dem = None
+        self.__label_index = None
+
+    def _load(self, i3d_fn: str, tree_source: str, raster_source: Path, lazy_i3d: bool, cache):
+        self.cache = disk_cache.DiskCache() if cache is True else cache or None
+        subtrees = i3d.LazyI3d.default_subtrees + (tree_source,)
+        self.i3d_data = i3d.TransformGroup(file=i3d_fn, lazy=lazy_i3d, subtrees=subtrees, cache=self.cache)
+        self.terrain = i3d.Terrain(i3d=self.i3d_data.data, index=self.i3d_data.index)
+        self.tree_source = tree_source
+        self.raster = simple_rasters.read_mapped(raster_source, cache=self.cache)
+        self.dem_files = self.terrain.get_dem_files()
+        assert self.dem_files, _("DEM not found in i3d")
+        self.catalogue = TreeCatalogue(self.trees[0][0])
+        self.units_per_pixel = float(self.terrain.get_transform_group()[0][self.terrain.prefix('unitsPerPixel')])
 
     def _load_dem(self):
         dem_ref = self.dem_files[0][0][self.terrain.prefix('filename')]
         dem_path = os.path.join(os.path.dirname(self.i3d_data.file), dem_ref)
-        self.__dem = simple_rasters.read_img(dem_path)
+        self.__dem = simple_rasters.read_mapped(dem_path, cache=self.cache)
 
     @property
     def dem(self):
         if self.__dem is None:
-            self._load_dem()
+            with self.instrumentation.stage("load"):
+                self._load_dem()
         return self.__dem
 
+    @property
+    def label_index(self) -> LabelIndex:
+        if self.__label_index is None:
+            with self.instrumentation.stage("index"):
+                self.__label_index = LabelIndex(self.raster)
+        return self.__label_index
+
+    def share_arrays(self, directory: str):
+        """
+        swaps the raster, DEM and label index for read only memmaps in `directory` so the generator can be sent to
+        worker processes without copying them, rasters that are already mapped from the cache are kept
+        """
+        label_index = copy.copy(self.label_index)
+        label_index.share(directory)
+        self.__label_index = label_index
+        self.__dem = shared_arrays.share(self.dem, directory, "dem")
+        self.raster = shared_arrays.share(self.raster, directory, "raster")
+
+    def __copy__(self):
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        return clone
+
+    def __getstate__(self):
+        state = shared_arrays.pack_state(self.__dict__)
+        state.update(i3d_data=None, terrain=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(shared_arrays.unpack_state(state))
+
     @property
     def trees(self):
         return self.i3d_data.get_by_name(self.tree_source).copy()
 
-    def read_records(self, path: str = None):
+    def read_records(self, path: str = None, targets: set = None, fields: set = ()):
+        """
+        the forest records of the xml or shp file
+        :param targets: only read the records with these ids (all when None)
+        :param fields: shp fields to read on top of the ones the generator uses
+        """
         if (path and "xml" in path) or self.xml_raster_metadata:
-            return list(self.read_xml(path))
+            records = self.read_xml(path)
+            return [record for record in records if targets is None or record.record.id in targets]
         elif (path and "shp" in path) or self.shp:
-            return self.read_shp(path)
+            return list(self.iter_shp(path, targets=targets, fields=fields))
         else:
             raise AssertionError("a shp or xml file must be provided")
 
@@ -69,166 +142,366 @@ class ForestGenerator:
         return XmlForests(xml_file=path or self.xml_raster_metadata).get_records()
 
     def read_shp(self, path: str = None):
+        import shapefile
+
         with shape_readers(**shape_components(path or self.shp)) as readers:
             reader = shapefile.Reader(**readers)
             self.__shp_records = [x for x in reader.iterShapeRecords()]
             self.__shp_fields = reader.fields.copy()
         return self.__shp_records
 
-    def run(self, shp_key: str = "id", target_ids: list = None):
-        records = self.read_records()
-        target_records = target_ids or []
-        if not target_records:
-            target_records.extend([getattr(x.record, shp_key) for x in records])
-        forests = []
-        forest_number = 0
+    def iter_shp(self, path: str = None, targets: set = None, fields: set = ()):
+        """
+        streams the records of the shapefile, only reading the .dbf fields the generator uses (no geometry)
+        :param targets: only yield the records with these ids (all when None)
+        :param fields: fields to read on top of the ones the generator uses
+        """
+        fields = {"id", "densMult", "minSize", "maxSize"} | {tree.weight_field for tree in self.catalogue} | set(fields)
+        for values in iter_dbf_records(path or self.shp, fields=fields, key="id", targets=targets):
+            yield parallel.ForestRecord(record=values)
+
+    def run(self, shp_key: str = "id", target_ids: list = None, workers: int = 1, seed: int = None,
+            tile_rows: int = None, cache_dir: str = None):
+        """
+        generates every targeted forest and stores them in the autoForests transform group
+        :param shp_key: the record attribute holding the raster value
+        :param target_ids: only generate forests with these ids (all when empty)
+        :param workers: number of processes to generate forests with, the output does not depend on it
+        :param seed: seed for the random streams, the same seed gives the same forests (random when None)
+        :param tile_rows: generate each forest in strips of this many raster rows so only a strip of the raster has
+        to be processed at a time, the output does not depend on it (a single strip per forest when None)
+        :param cache_dir: keep the generated forests in this directory and reuse them while their inputs are
+        unchanged (see `ForestCache`). needs a seed, a random seed could never be reused so the cache is skipped
+        """
+        forests = self.iter_forests(shp_key=shp_key, target_ids=target_ids, workers=workers, seed=seed,
+                                    tile_rows=tile_rows, cache_dir=cache_dir)
+        forests = [forest.collect() if isinstance(forest, ForestTiles) else forest for forest in forests]
+        self.instrumentation.log(sum([len(x) for x in forests]))
+        forests = [forest.node(self.catalogue) for forest in forests]
+        autoForests = self.i3d_data.get_by_name('autoForests')
+        self.i3d_data.replace_children(autoForests[0][0], forests)
+
+    def iter_forests(self, shp_key: str = "id", target_ids: list = None, workers: int = 1, seed: int = None,
+                     tile_rows: int = None, cache_dir: str = None):
+        """
+        generates the targeted forests one at a time, see `run` for the parameters. in a single process these are
+        ForestTiles that are only generated while they are written, worker processes return ForestInstances
+        """
+        targets = set(target_ids) if target_ids else None
+        records = self.read_records(targets=targets, fields={shp_key})
+        if targets is None:
+            targets = {getattr(x.record, shp_key) for x in records}
+        self.seed = numpy.random.SeedSequence(seed).entropy
+        self.instrumentation.log(_("seed: {}").format(self.seed))
         ident = 100000
-        transform = TransformGroup()
-        tree_species = self.trees[0][0][transform.default_label]
-        rand_array = numpy.random.randint(0, len(tree_species)-1, self.raster.shape)
+        jobs = []
         for record in records:
-            if record.record.id not in target_records:
+            if record.record.id not in targets:
                 continue
-            forest_number += 1
-            density_multiplier = (record.record.densMult or 1.0) * self.global_density_factor
-            forest = self.generate(record, forest_number=forest_number, id_start=ident, rand_array=rand_array)
-            smaller_forest = self.thin_forest(forest, percent_to_keep=random.randint(45, 75) * density_multiplier)
-            forests.append(smaller_forest)
-        print(sum([len(x) for x in forests]))
-        autoForests = self.i3d_data.get_by_name('autoForests')
-        autoForests[0][0]['TransformGroup'] = forests
-
-    def generateMask(self, record: shapefile.ShapeRecord, rand_array: numpy.ndarray, species: list = [],
-                     weighting: list = []):
-        transform = TransformGroup()
-        mask = numpy.ma.equal(self.raster, record.record.id)
-        aoi = rand_array * mask
-        masked = aoi * self.prune_neighbors(aoi)
-        log_choice = numpy.flip(numpy.logspace(0, 1, len(species), base=10))
-        _weighting = list(weighting.values()) if isinstance(weighting, dict) else weighting
-        if _weighting:
-            probabilities = _weighting
+            jobs.append((record, len(jobs) + 1, ident, self.seed, tile_rows))
+            # every forest gets its own id range, no forest can hold more trees than it has pixels
+            ident += self.label_index.count(record.record.id) + 1
+        if cache_dir is not None and seed is None:
+            self.instrumentation.warn(_("the forest cache needs a seed, generating without it"))
+        elif cache_dir is not None:
+            return self._iter_cached(jobs, workers, ForestCache(cache_dir))
+        if workers > 1:
+            return parallel.generate_forests(self, jobs, workers)
+        return (self.forest_tiles(*job) for job in jobs)
+
+    def _iter_cached(self, jobs: list, workers: int, cache: ForestCache):
+        keys = [self.forest_key(job[0], job[3]) for job in jobs]
+        cached = {key for key in keys if key in cache}
+        missing = [job for job, key in zip(jobs, keys) if key not in cached]
+        self.instrumentation.log(_("reusing {} of {} forests").format(len(jobs) - len(missing), len(jobs)))
+        if workers > 1:
+            generated = parallel.generate_forests(self, missing, workers)
         else:
-            probabilities = log_choice / log_choice.sum()
-        print(_("Probabilities:"))
-        for i in range(len(probabilities)):
-            print(f"{species[i][transform.name]}: {round(probabilities[i] * 100, 2)}%")
-        tree_species = numpy.random.choice(list(range(0, len(species))), mask.count(), p=probabilities)
-
-        y_loc = 0
-        locations = []
-        print(_("masking grid..."))
-        i = 0
-        for (x, y), val in numpy.ndenumerate(masked):
-            if val > 0:
-                locations.append({'x': x, 'y': y, 'z': species[tree_species[i]]})
-                i += 1
-        return locations
-
-    def generate(self, record: shapefile.ShapeRecord, rand_array: numpy.ndarray, forest_number: int = 1,
-                 id_start: int = 1000000, gitter=1.25, z_offset=-0.05):  # , tree_types:list =[]):
-        print(_("processing forest #" + str(forest_number)))
-        transform = TransformGroup()
-        terrain_pixel_scale = float(self.terrain.get_transform_group()[0][transform.prefix('unitsPerPixel')])
-        prefix = 'base'
-        forest = transform.new_transform_group(name=f"forest{forest_number}", identifier=id_start, children=[])
-        id_start += 1
-        trees = self.trees[0][0][transform.default_label]
-        tree_names = list(map(lambda x: x[transform.name].lstrip(prefix), trees))
-        tree_weights = list(map("wgt{}".format, tree_names))
+            generated = (self.generate_forest(*job) for job in missing)
+        for job, key in zip(jobs, keys):
+            if key in cached:
+                yield cache.load(key, name=f"forest{job[1]}", node_id=job[2])
+            else:
+                forest = next(generated)
+                cache.store(key, forest)
+                yield forest
+
+    def forest_key(self, record: "shapefile.ShapeRecord", seed: int) -> str:
+        """
+        hashes everything a forest depends on apart from its number and id range: the record's attributes, the
+        label's pixels, the DEM samples under them, the tree templates and the generation settings
+        """
+        digest = hashlib.sha256()
+        fields = sorted(vars(parallel.portable_record(record).record).items())
+        settings = (FOREST_CACHE_VERSION, seed, self.global_density_factor, self.units_per_pixel,
+                    self.raster.shape, self.dem.shape, self.catalogue.digest, self.placement,
+                    json.dumps(self.spacing, sort_keys=True))
+        digest.update(repr((fields, settings)).encode("utf-8"))
+        pixels = self.label_index.flat_pixels(record.record.id)
+        digest.update(pixels.astype('<i8').tobytes())
+        rows, columns = numpy.unravel_index(pixels, self.raster.shape)
+        rows = rows.astype(numpy.int64) - 1
+        columns = columns.astype(numpy.int64)
+        if len(rows) and rows.max() + 2 < self.dem.shape[0] and columns.max() + 1 < self.dem.shape[1]:
+            # the two samples `placement.sample_heights` averages
+            digest.update(numpy.ascontiguousarray(self.dem[rows, columns - 1]).tobytes())
+            digest.update(numpy.ascontiguousarray(self.dem[rows, columns]).tobytes())
+        return digest.hexdigest()
+
+    def write(self, path: str, forests=None, backup: bool = False):
+        """
+        writes the i3d to `path` (which may be the source i3d) by copying the source file and streaming the forests
+        into autoForests, so the generated trees never have to be held in memory all at once
+        :param path: target i3d file
+        :param forests: iterable of ForestInstances/ForestTiles or forest transform groups, e.g. `iter_forests()`,
+        defaults to the ones stored by `run`
+        :param backup: keep the replaced i3d as `<path>.bak`
+        """
+        if forests is None:
+            forests = self.i3d_data.get_by_name('autoForests')[0][0].get('TransformGroup') or []
+        forests = (
+            forest.node(self.catalogue, lazy=True) if isinstance(forest, (ForestInstances, ForestTiles)) else forest
+            for forest in forests
+        )
+        # the forests are generated while they are written, their stages are not counted as writing
+        with self.instrumentation.stage("write"):
+            i3d.write_stream(self.i3d_data.file, path, {'autoForests': forests}, backup=backup)
+
+    def generate_forest(self, record: "shapefile.ShapeRecord", forest_number: int, id_start: int, seed: int,
+                        tile_rows: int = None) -> ForestInstances:
+        """
+        generates and thins a single forest from its own random streams (derived from the seed and the record id)
+        """
+        return self.forest_tiles(record, forest_number, id_start, seed, tile_rows=tile_rows).collect()
+
+    def forest_tiles(self, record: "shapefile.ShapeRecord", forest_number: int, id_start: int, seed: int,
+                     tile_rows: int = None) -> ForestTiles:
+        if self.placement == "poisson":
+            tiles = self.iter_poisson(record, forest_number=forest_number, id_start=id_start, seed=seed)
+        else:
+            tiles = self.iter_tiles(record, forest_number=forest_number, id_start=id_start, seed=seed,
+                                    tile_rows=tile_rows)
+        return ForestTiles(name=f"forest{forest_number}", node_id=id_start, tiles=tiles)
+
+    def forest_weights(self, record: "shapefile.ShapeRecord") -> list:
+        """
+        the species weights of a record (`wgt<Species>` attributes), the defaults when they are missing or invalid
+        """
         weights = [0.37, 0.53, 0.07, 0.03]
         shp_weights = {}
-        for tree_weight in tree_weights:
+        for tree in self.catalogue:
             try:
-                _weight = getattr(record.record, tree_weight)
-            except AttributeError as exc:
-                print(_("missing tree weights for shp with name:") + tree_weight)
+                _weight = getattr(record.record, tree.weight_field)
+            except AttributeError:
+                self.instrumentation.warn(_("missing tree weights for shp with name:") + tree.weight_field)
             else:
                 if _weight is not None:
-                    shp_weights[tree_weight] = _weight
+                    shp_weights[tree.weight_field] = _weight
         if shp_weights:
             if sum(shp_weights.values()) == 1:
                 weights = shp_weights
             else:
-                print(_("weights do not sum to 1.0 for {}").format(record.record.id))
+                self.instrumentation.warn(_("weights do not sum to 1.0 for {}").format(record.record.id))
+        return weights
+
+    def _occupancy(self, pixels: numpy.ndarray, first_row: int, stop_row: int, columns: slice,
+                   streams: RandomStreams, species_count: int) -> numpy.ndarray:
+        """
+        randomly fills a label's pixels in raster rows `first_row` to `stop_row` (and `columns`). rows above the
+        raster wrap around to its bottom like python indices, rows below it are empty
+        :param pixels: the label's flat pixel offsets, in raster order
+        """
+        size, width = self.raster.shape
+        block = numpy.zeros((stop_row - first_row, columns.stop - columns.start), dtype=bool)
+        # (first raster row, stop raster row, block row of the first raster row)
+        runs = [(max(first_row, 0), min(stop_row, size), max(first_row, 0))]
+        if first_row < 0:
+            start = max(first_row, -size)
+            runs.append((start + size, min(stop_row, 0) + size, start))
+        for start, stop, block_row in runs:
+            if start >= stop:
+                continue
+            low, high = numpy.searchsorted(pixels, [start * width, stop * width]).tolist()
+            run = pixels[low:high]
+            # the stream is indexed by the pixel's rank in the label, so a pixel gets the same value in every strip
+            occupied = streams.integers(OCCUPANCY, low, species_count - 1, count=high - low) > 0
+            block[run // width - start + block_row - first_row, run % width - columns.start] = occupied
+        return block
+
+    def iter_candidates(self, record: "shapefile.ShapeRecord", streams: RandomStreams, species: list = [],
+                        weighting: list = [], distance: int = 2, tile_rows: int = None):
+        """
+        finds the pixels of a record that should hold a tree and picks a species for each of them, a strip of
+        `tile_rows` raster rows (all rows when None) at a time. every strip is extended by the pruning distance so
+        pruning sees the same neighbors as on the whole raster
+        :return: yields a structured array of `CANDIDATE_DTYPE` (x, y, species index) per strip, in raster order
+        """
+        log_choice = numpy.flip(numpy.logspace(0, 1, len(species), base=10))
+        _weighting = list(weighting.values()) if isinstance(weighting, dict) else weighting
+        if _weighting:
+            probabilities = _weighting
+        else:
+            probabilities = log_choice / log_choice.sum()
+        self.instrumentation.log(_("Probabilities:"))
+        for i in range(len(probabilities)):
+            self.instrumentation.log(f"{species[i].name}: {round(probabilities[i] * 100, 2)}%")
+        bounds = self.label_index.bounds(record.record.id)
+        if bounds is None:
+            return
+        pixels = self.label_index.flat_pixels(record.record.id)
+        (_rows, columns), wrap = pruning.pruning_window(bounds, self.raster.shape, distance)
+        tile_rows = tile_rows or bounds[1] - bounds[0]
+        self.instrumentation.log(_("pruning values..."))
+        rank = 0
+        pruned = 0
+        for top in range(bounds[0], bounds[1], tile_rows):
+            bottom = min(top + tile_rows, bounds[1])
+            with self.instrumentation.stage("mask"):
+                occupied = self._occupancy(pixels, top - distance, bottom + distance, columns, streams,
+                                           len(species))
+            with self.instrumentation.stage("prune"):
+                keep = pruning.prune_neighbors(occupied, distance=distance, wrap=(False, wrap[1]))
+                keep = keep[distance:distance + bottom - top]
+            occupied_count = int(numpy.count_nonzero(occupied[distance:distance + bottom - top]))
+            self.instrumentation.count("occupied", occupied_count)
+            pruned += occupied_count - int(numpy.count_nonzero(keep))
+            xs, ys = numpy.nonzero(keep)
+            candidates = numpy.empty(len(xs), dtype=CANDIDATE_DTYPE)
+            candidates['x'] = xs + top
+            candidates['y'] = ys + columns.start
+            candidates['species'] = streams.choice(SPECIES, rank, probabilities, len(xs))
+            rank += len(xs)
+            yield candidates
+        self.instrumentation.count("pruned", pruned)
+        self.instrumentation.log(_("pruned {}").format(pruned))
+
+    def generate_candidates(self, record: "shapefile.ShapeRecord", seed: int, species: list = [],
+                            weighting: list = [], distance: int = 2) -> numpy.ndarray:
+        """
+        all candidates of a record at once, see `iter_candidates`
+        """
+        streams = RandomStreams(seed, record.record.id)
+        strips = list(self.iter_candidates(record, streams, species=species, weighting=weighting, distance=distance))
+        return numpy.concatenate(strips) if strips else numpy.empty(0, dtype=CANDIDATE_DTYPE)
+
+    def generateMask(self, record: "shapefile.ShapeRecord", seed: int, species: list = [], weighting: list = []):
+        candidates = self.generate_candidates(record, seed, species=species, weighting=weighting)
+        return [{'x': x, 'y': y, 'z': species[z]} for x, y, z in candidates.tolist()]
+
+    def iter_tiles(self, record: "shapefile.ShapeRecord", forest_number: int = 1, id_start: int = 1000000,
+                   seed: int = None, gitter=1.25, z_offset=-0.05, tile_rows: int = None):
+        """
+        generates a forest in strips of `tile_rows` raster rows, yielding the thinned trees as ForestInstances. every
+        random number is read from a stream at the position of its pixel or tree and unfinished thinning chunks are
+        carried over to the next strip, so the trees do not depend on the strip size
+        """
+        self.instrumentation.begin_forest(forest_number, record.record.id)
+        self.instrumentation.log(_("processing forest #" + str(forest_number)))
+        seed = numpy.random.SeedSequence().entropy if seed is None else seed
+        streams = RandomStreams(seed, record.record.id)
+        density_multiplier = (record.record.densMult or 1.0) * self.global_density_factor
+        percent_to_keep = (45 + int(streams.integers(THINNING_PERCENT, 0, 31, count=1)[0])) * density_multiplier
+        species = self.catalogue.species
+        stage_table = self.catalogue.stage_table(record.record.minSize, record.record.maxSize)
+        if not stage_table.complete:
+            self.instrumentation.warn(_("found invalid min/max size for record (or no tree of permitted ages)#") +
+                                      str(record.record.id))
+        name = f"forest{forest_number}"
+        pending = numpy.empty(0, dtype=CANDIDATE_DTYPE)
+        first_tree = 0
         tree_count = {}
-        for loc in self.generateMask(record=record, rand_array=rand_array, species=trees, weighting=weights):
-            clone_tree = loc['z'].copy()
-            tree_tg = clone_tree[transform.default_label]
-            no_prefix = clone_tree[transform.name].lstrip(prefix).lower()
-            tree_count.setdefault(no_prefix, {})
-            try:
-                available_ages = [int(x[transform.name].lstrip(f"{no_prefix}_stage")) for x in tree_tg]
-            except TypeError as exc:
-                clone_tree_list = [[tree_tg]]  # a single tree in the group causes this (maple)
-                rand_choice = tree_tg[transform.name].lstrip(f"{no_prefix}_stage")
+        total = 0
+        strips = self.iter_candidates(record=record, streams=streams, species=species,
+                                      weighting=self.forest_weights(record), tile_rows=tile_rows)
+        for strip in itertools.chain(strips, [None]):
+            if strip is not None:
+                pending = numpy.concatenate([pending, strip[stage_table.available(strip['species'])]])
+                # only whole thinning chunks are placed, the rest waits for the next strip
+                ready = len(pending) // THINNING_CHUNK * THINNING_CHUNK
             else:
-                available_ages = [x for x in available_ages if record.record.minSize <= x <= record.record.maxSize]
-                if not available_ages:
-                    print(_("found invalid min/max size for record (or no tree of permitted ages)#") + str(
-                        record.record.id))
-                    continue
-                rand_choice = random.choice(available_ages)
-                target_name = f"{no_prefix}_stage{rand_choice}"
-                clone_tree_list = get_for_key(transform.name, target_name, dict(root=tree_tg))
-            tree_count[no_prefix].setdefault(str(rand_choice), 0)
-            tree_count[no_prefix][str(rand_choice)] += 1
-            x_gitter = abs(random.random()) % (gitter - gitter * 2)
-            y_gitter = abs(random.random()) % (gitter - gitter * 2)
-            dem_values = []
-            for _x in range(loc['x']-1, loc['x']+2):
-                for _y in range(loc['y']-1, loc['y']+2):
-                    dem_values.append(self.dem[_x, _y])
-            dem_height = sum(sorted(dem_values[:2]))/2
-            z_val = dem_height / (pow(2, 16) / pow(2, 8)) + z_offset
-            loc_str = "{x} {z} {y}".format(
-                **{
-                    "x": ((float(loc['y']) - self.raster.shape[0] / 2) * terrain_pixel_scale) + x_gitter,
-                    "y": ((float(loc['x']) - self.raster.shape[1] / 2) * terrain_pixel_scale) + y_gitter,
-                    'z': z_val
-                }
-            )
-            if clone_tree_list:
-                tree = clone_tree_list[0][0].copy()
-                tree[transform.translation] = loc_str
-                rotate = map(str, [0, round(abs(random.random() % 360), 2) - 180, 0])
-                tree[transform.rotation] = "{} {} {}".format(*rotate)
-                tree[transform.id] = str(id_start)
-                id_start += 1
-                forest[transform.default_label].append(tree)
-        print(_("forest #{} has {} trees").format(forest_number, len(forest[transform.default_label])))
-        print(json.dumps(tree_count, indent=2, sort_keys=True))
-        return forest
-
-    def prune_neighbors(self, arr: numpy.ndarray, distance=2):
-        comp_arr = numpy.full(arr.shape, True, dtype=int)
-        print(_("pruning values..."))
-        for (x, y), item in numpy.ndenumerate(arr):
-            summed = 0
-            if item > 0:
-                for xd in range(x-distance, x+distance+1):
-                    if summed > 1:
-                        continue
-                    for yd in range(y-distance, y+distance+1):
-                        with suppress(IndexError):
-                            summed += (1 if arr[xd][yd] > 0 else 0)
-            comp_arr[x][y] = int(summed)
-        mask = numpy.ma.greater(comp_arr, 1)
-        print(_("pruned {}").format(mask.count()))
-        return arr * mask
-
-    def thin_forest(self, forest: collections.OrderedDict, percent_to_keep=75):
-        transform = TransformGroup()
-
-        chunks = [
-            forest[transform.default_label][i:i + 100] for i in range(0, len(forest[transform.default_label]), 100)
-        ]
-        thinned_forest = []
-        for chunk in chunks:
-            to_keep = random.sample(chunk, int(max(1, math.floor(len(chunk) * (percent_to_keep / 100)))))
-            thinned_forest.extend(to_keep)
-        forest[transform.default_label] = thinned_forest
-        return forest
+                ready = len(pending)
+            if not ready:
+                continue
+            trees, pending = pending[:ready], pending[ready:]
+            with self.instrumentation.stage("thin"):
+                uniforms = streams.trees(first_tree, ready)
+                keep = thinning_mask(uniforms.thinning, percent_to_keep)
+                trees = trees[keep]
+                index = first_tree + numpy.flatnonzero(keep)
+            self.instrumentation.count("thinned", ready - len(trees))
+            with self.instrumentation.stage("place"):
+                placed = placement.transform_trees(trees['x'], trees['y'], self.dem, self.raster.shape,
+                                                   self.units_per_pixel, uniforms.jitter[keep],
+                                                   uniforms.rotation[keep], gitter=gitter, z_offset=z_offset)
+                stages = stage_table.pick(trees['species'], uniforms.stage[keep])
+            first_tree += ready
+            forest = ForestInstances(name=name, node_id=id_start, translations=placed.translations,
+                                     rotations=placed.rotations, species=trees['species'], stages=stages,
+                                     ids=id_start + 1 + index)
+            total += len(forest)
+            self.instrumentation.count("trees", len(forest))
+            if not self.instrumentation.quiet:
+                for key, ages in forest.counts(self.catalogue).items():
+                    for age, count in ages.items():
+                        tree_count.setdefault(key, {}).setdefault(age, 0)
+                        tree_count[key][age] += count
+            yield forest
+        self.instrumentation.log(_("forest #{} has {} trees").format(forest_number, total))
+        self.instrumentation.log(json.dumps(tree_count, indent=2, sort_keys=True))
+        self.instrumentation.end_forest()
+
+    def iter_poisson(self, record: "shapefile.ShapeRecord", forest_number: int = 1, id_start: int = 1000000,
+                     seed: int = None, z_offset=-0.05, attempts: float = 10):
+        """
+        generates a forest with blue noise placement instead of the pixel mask: trees are sampled anywhere in the
+        label and kept at least their species/stage `spacing` apart, scaled by the record's and the global density.
+        yields the forest as a single ForestInstances
+        :param attempts: candidate trees per square of the smallest spacing
+        """
+        self.instrumentation.begin_forest(forest_number, record.record.id)
+        self.instrumentation.log(_("processing forest #" + str(forest_number)))
+        seed = numpy.random.SeedSequence().entropy if seed is None else seed
+        streams = RandomStreams(seed, record.record.id)
+        stage_table = self.catalogue.stage_table(record.record.minSize, record.record.maxSize)
+        if not stage_table.complete:
+            self.instrumentation.warn(_("found invalid min/max size for record (or no tree of permitted ages)#") +
+                                      str(record.record.id))
+        weighting = self.forest_weights(record)
+        probabilities = list(weighting.values()) if isinstance(weighting, dict) else weighting
+        distances = poisson.distance_table(self.catalogue, self.spacing) / self.units_per_pixel
+        density = (record.record.densMult or 1.0) * self.global_density_factor
+        pixels = self.label_index.flat_pixels(record.record.id)
+        with self.instrumentation.stage("place"):
+            positions, species, stages, rotation_uniforms = poisson.sample_label(
+                pixels, self.raster.shape[1], distances, probabilities, stage_table, streams.generator(POISSON),
+                attempts=attempts, density=density)
+            placed = placement.place_points(positions[:, 0], positions[:, 1], self.dem, self.raster.shape,
+                                            self.units_per_pixel, rotation_uniforms, z_offset=z_offset)
+        forest = ForestInstances(name=f"forest{forest_number}", node_id=id_start, translations=placed.translations,
+                                 rotations=placed.rotations, species=species, stages=stages,
+                                 ids=id_start + 1 + numpy.arange(len(species), dtype=numpy.int64))
+        self.instrumentation.count("trees", len(forest))
+        self.instrumentation.log(_("forest #{} has {} trees").format(forest_number, len(forest)))
+        if not self.instrumentation.quiet:
+            self.instrumentation.log(json.dumps(forest.counts(self.catalogue), indent=2, sort_keys=True))
+        self.instrumentation.end_forest()
+        yield forest
+
+    def generate(self, record: "shapefile.ShapeRecord", forest_number: int = 1, id_start: int = 1000000, gitter=1.25,
+                 z_offset=-0.05, seed: int = None, tile_rows: int = None) -> ForestInstances:
+        tiles = self.iter_tiles(record, forest_number=forest_number, id_start=id_start, seed=seed, gitter=gitter,
+                                z_offset=z_offset, tile_rows=tile_rows)
+        return ForestInstances.concatenate(f"forest{forest_number}", id_start, tiles)
+
+    def prune_neighbors(self, arr: numpy.ndarray, distance=2, threshold=1, wrap=(True, True)):
+        self.instrumentation.log(_("pruning values..."))
+        with self.instrumentation.stage("prune"):
+            keep = pruning.prune_neighbors(arr, distance=distance, threshold=threshold, wrap=wrap)
+        self.instrumentation.log(_("pruned {}").format(int(numpy.count_nonzero(numpy.asarray(arr) > 0) - numpy.count_nonzero(keep))))
+        return arr * keep
+
+    def thin_forest(self, forest: ForestInstances, percent_to_keep=75, rng: numpy.random.Generator = None):
+        return forest.thin(percent_to_keep, rng or numpy.random.default_rng())
 
 
 if __name__ == "__main__":
@@ -240,8 +513,7 @@ if __name__ == "__main__":
     rasterized = Path(r"D:\Games\MyMods\Sussex\maps\mapNB1\forests.png")
     xml_fn = Path(r"D:\Games\MyMods\Sussex\xml\forests.xml")
     fg = ForestGenerator(i3d_file, i3d_tree_sources, rasterized, shp, xml_raster_metadata=xml_fn)
-    fg.run()
     # target_fn = os.path.join(os.path.dirname(i3d_file), "forest_" + os.path.basename(i3d_file))
     target_fn = os.path.join(os.path.dirname(i3d_file), os.path.basename(i3d_file))
-    i3d.write(i3d_contents=fg.i3d_data.data, path=target_fn)
+    fg.write(target_fn, forests=fg.iter_forests())
     print(f"Done! wrote to {target_fn}")
@@ -0,0 +1,150 @@
+import collections
+import itertools
+
+import numpy
+
+from fstools.generate.forests import placement
+from fstools.util.i3d import TransformGroup
+
+THINNING_CHUNK = 100
+
+
+def thinning_mask(keys: numpy.ndarray, percent_to_keep: float, chunk_size: int = THINNING_CHUNK) -> numpy.ndarray:
+    """
+    picks `max(1, floor(len(chunk) * percent_to_keep / 100))` random trees out of every `chunk_size` consecutive trees
+    without a per chunk loop: the trees with the lowest keys of each chunk are kept
+    :param keys: a random key (uniform) per tree
+    :param percent_to_keep: percentage of each chunk to keep
+    :param chunk_size: number of consecutive trees thinned together
+    :return: a boolean array of the trees to keep, in tree order
+    """
+    count = len(keys)
+    chunks = numpy.arange(count) // chunk_size
+    sizes = numpy.bincount(chunks)
+    to_keep = numpy.maximum(1, numpy.floor(sizes * (percent_to_keep / 100))).astype(numpy.int64)
+    order = numpy.lexsort((keys, chunks))
+    rank = numpy.empty(count, dtype=numpy.int64)
+    rank[order] = numpy.arange(count) - chunks[order] * chunk_size
+    return rank < to_keep[chunks]
+
+
+class ForestInstances:
+    __slots__ = ("name", "node_id", "translations", "rotations", "species", "stages", "ids")
+
+    def __init__(self, name: str, node_id: int, translations: numpy.ndarray, rotations: numpy.ndarray,
+                 species: numpy.ndarray, stages: numpy.ndarray, ids: numpy.ndarray):
+        """
+        the trees of a generated forest as columns instead of a transform group per tree, the i3d nodes are only
+        created (from the catalogue templates) when the forest is written
+        :param name: name of the forest transform group
+        :param node_id: nodeId of the forest transform group
+        :param translations: (n, 3) tree positions
+        :param rotations: (n, 3) tree rotations in degrees
+        :param species: index of each tree's species in the catalogue
+        :param stages: index of each tree's stage in its species
+        :param ids: nodeId of each tree
+        """
+        self.name = name
+        self.node_id = node_id
+        self.translations = translations
+        self.rotations = rotations
+        self.species = species
+        self.stages = stages
+        self.ids = ids
+
+    @classmethod
+    def concatenate(cls, name: str, node_id: int, forests: list) -> "ForestInstances":
+        """
+        joins the trees of several forests (e.g. the tiles of one) into a forest called `name`
+        """
+        forests = list(forests) or [cls.empty(name, node_id)]
+        return cls(name, node_id, *(numpy.concatenate([getattr(forest, column) for forest in forests])
+                                    for column in cls.__slots__[2:]))
+
+    @classmethod
+    def empty(cls, name: str, node_id: int) -> "ForestInstances":
+        return cls(name, node_id, translations=numpy.empty((0, 3)), rotations=numpy.empty((0, 3)),
+                   species=numpy.empty(0, dtype=numpy.int16), stages=numpy.empty(0, dtype=numpy.int16),
+                   ids=numpy.empty(0, dtype=numpy.int64))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getstate__(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __setstate__(self, state):
+        for key, value in state.items():
+            setattr(self, key, value)
+
+    def select(self, mask: numpy.ndarray) -> "ForestInstances":
+        """
+        a forest with only the trees selected by a boolean mask (or index array)
+        """
+        return ForestInstances(self.name, self.node_id, self.translations[mask], self.rotations[mask],
+                               self.species[mask], self.stages[mask], self.ids[mask])
+
+    def thin(self, percent_to_keep: float, rng: numpy.random.Generator) -> "ForestInstances":
+        return self.select(thinning_mask(rng.random(len(self)), percent_to_keep))
+
+    def counts(self, catalogue) -> dict:
+        """
+        number of trees per species key and stage age
+        """
+        tree_count = {}
+        if not len(self):
+            return tree_count
+        pairs, counts = numpy.unique(numpy.stack([self.species, self.stages], axis=1), axis=0, return_counts=True)
+        for (species, stage), count in zip(pairs.tolist(), counts.tolist()):
+            tree = catalogue[species]
+            tree_count.setdefault(tree.key, {})[str(tree.stages[stage].age)] = count
+        return tree_count
+
+    def tree_nodes(self, catalogue, batch_size: int = 4096):
+        """
+        yields the tree transform groups, the attribute strings are formatted a batch at a time
+        """
+        for start in range(0, len(self), batch_size):
+            stop = start + batch_size
+            translations = placement.format_vectors(self.translations[start:stop])
+            rotations = placement.format_vectors(self.rotations[start:stop])
+            columns = (self.species[start:stop].tolist(), self.stages[start:stop].tolist(), translations, rotations,
+                       self.ids[start:stop].tolist())
+            for species, stage, translation, rotation, node_id in zip(*columns):
+                yield catalogue[species].stages[stage].node(translation, rotation, node_id)
+
+    def node(self, catalogue, lazy: bool = False) -> collections.OrderedDict:
+        """
+        the forest transform group
+        :param catalogue: the TreeCatalogue the species and stage indices refer to
+        :param lazy: give the forest a generator of trees (for `i3d.write_stream`) instead of a list
+        """
+        trees = self.tree_nodes(catalogue)
+        return TransformGroup().new_transform_group(name=self.name, identifier=self.node_id,
+                                                    children=trees if lazy else list(trees))
+
+
+class ForestTiles:
+    __slots__ = ("name", "node_id", "tiles")
+
+    def __init__(self, name: str, node_id: int, tiles):
+        """
+        a forest that is generated while it is written, tile by tile
+        :param name: name of the forest transform group
+        :param node_id: nodeId of the forest transform group
+        :param tiles: iterable of ForestInstances, it is only consumed once
+        """
+        self.name = name
+        self.node_id = node_id
+        self.tiles = tiles
+
+    def collect(self) -> ForestInstances:
+        return ForestInstances.concatenate(self.name, self.node_id, self.tiles)
+
+    def node(self, catalogue, lazy: bool = False) -> collections.OrderedDict:
+        """
+        the forest transform group, see `ForestInstances.node`
+        """
+        trees = itertools.chain.from_iterable(tile.tree_nodes(catalogue) for tile in self.tiles)
+        return TransformGroup().new_transform_group(name=self.name, identifier=self.node_id,
+                                                    children=trees if lazy else list(trees))
@@ -0,0 +1,229 @@
+"""
+timers and counters of the forest pipeline. stages are timed exclusively (a stage running inside another one is not
+counted twice), grouped per forest and handed to sinks when a forest or the run is done:
+
+    instrumentation = Instrumentation(sinks=[JsonLogSink("forests.jsonl")], quiet=True)
+    generator = ForestGenerator(..., instrumentation=instrumentation)
+    generator.write(path, forests=generator.iter_forests())
+    instrumentation.finish()
+"""
+import collections
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from fstools.i18n import _
+
+STAGES = ("load", "index", "mask", "prune", "place", "thin", "write")
+
+
+class Report:
+    __slots__ = ("forest", "key", "stages", "counters", "peak_mb")
+
+    def __init__(self, forest=None, key=None):
+        """
+        the stage times (seconds) and counters of a forest, or of the whole run when `forest` is None
+        :param forest: number of the forest
+        :param key: the forest's record id
+        """
+        self.forest = forest
+        self.key = key
+        self.stages = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+        self.peak_mb = None
+
+    def add(self, other: "Report"):
+        for name, seconds in other.stages.items():
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        for name, value in other.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def as_dict(self) -> dict:
+        values = collections.OrderedDict(forest=self.forest, key=self.key)
+        values["stages"] = {name: round(seconds, 6) for name, seconds in self.stages.items()}
+        values["counters"] = dict(self.counters)
+        if self.peak_mb is not None:
+            values["peak_mb"] = round(self.peak_mb, 1)
+        return values
+
+
+class ConsoleSink:
+    """
+    prints a line per forest and a table of the run's stages
+    """
+    # the per forest lines are progress output, `Instrumentation` doesn't hand forests to it in quiet mode
+    progress = True
+
+    def forest(self, report: Report):
+        stages = " ".join(f"{name} {seconds:.3f}s" for name, seconds in report.stages.items())
+        print(_("forest #{}: {} trees, {}").format(report.forest, report.counters.get("trees", 0), stages))
+
+    def run(self, report: Report):
+        total = sum(report.stages.values()) or 1.0
+        print(f"{_('stage'):<8} {_('seconds'):>9} {'%':>6}")
+        for name, seconds in report.stages.items():
+            print(f"{name:<8} {seconds:>9.3f} {seconds / total * 100:>6.1f}")
+        for name, value in report.counters.items():
+            print(f"{name:<12} {value}")
+
+
+class JsonLogSink:
+    def __init__(self, path: str):
+        """
+        appends a json line per forest and one for the run (`"forest": null`) to `path`
+        """
+        self.path = os.fspath(path)
+
+    def _write(self, report: Report):
+        with open(self.path, "a") as fo:
+            fo.write(json.dumps(report.as_dict()) + "\n")
+
+    def forest(self, report: Report):
+        self._write(report)
+
+    def run(self, report: Report):
+        self._write(report)
+
+
+class Instrumentation:
+    def __init__(self, sinks: list = (), quiet: bool = False, profile: str = None, trace_memory: bool = False):
+        """
+        :param sinks: get the report of every forest and of the run, objects with `forest(report)` and `run(report)`
+        :param quiet: drop the progress output (per forest and per tree messages), warnings are still shown
+        :param profile: write a cProfile of the run (in the process that calls `start`) to this path
+        :param trace_memory: record the peak of the python allocations (tracemalloc) of every forest
+        """
+        self.sinks = list(sinks)
+        self.quiet = quiet
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self._profiler = None
+        self._stack = []
+        self._run = Report()
+        self._forest = None
+        # reports of a worker process waiting to be sent to the parent, None in the parent
+        self._pending = None
+
+    def __getstate__(self):
+        # the profiler can't be pickled, the copy of a worker process is set up by `detach`
+        state = self.__dict__.copy()
+        state.update(_profiler=None, _stack=[], _forest=None, profile=None)
+        return state
+
+    def detach(self):
+        """
+        turns the copy of a worker process into one that keeps its forest reports for the parent (see `take_reports`)
+        instead of handing them to the sinks, so worker output doesn't interleave and the run's report is complete
+        """
+        if self._profiler is not None:
+            self._profiler.disable()
+        self._profiler = None
+        self.profile = None
+        self._stack = []
+        self._run = Report()
+        self._forest = None
+        self._pending = []
+
+    def start(self):
+        if self.profile and self._profiler is None:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def log(self, message: str):
+        """
+        progress output, dropped in quiet mode
+        """
+        if not self.quiet:
+            print(message)
+
+    def warn(self, message: str):
+        print(message, file=sys.stderr if self.quiet else sys.stdout)
+
+    @property
+    def report(self) -> Report:
+        """
+        the report stages and counters are added to: the current forest's, the run's outside of a forest
+        """
+        return self._run if self._forest is None else self._forest
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        times the block as `name`, without the time of the stages inside it
+        """
+        report = self.report
+        frame = [time.perf_counter(), 0.0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            elapsed = time.perf_counter() - frame[0]
+            report.stages[name] = report.stages.get(name, 0.0) + elapsed - frame[1]
+            if self._stack:
+                self._stack[-1][1] += elapsed
+
+    def count(self, name: str, value: int = 1):
+        report = self.report
+        report.counters[name] = report.counters.get(name, 0) + int(value)
+
+    def begin_forest(self, forest: int, key=None):
+        if self.trace_memory:
+            self.start()
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+        self._forest = Report(forest=forest, key=key)
+
+    def end_forest(self):
+        """
+        hands the current forest's report to the sinks and adds it to the run's
+        """
+        report, self._forest = self._forest, None
+        if report is None:
+            return
+        if self.trace_memory and tracemalloc.is_tracing():
+            report.peak_mb = tracemalloc.get_traced_memory()[1] / pow(2, 20)
+        if self._pending is not None:
+            self._pending.append(report)
+        else:
+            self.add_report(report)
+
+    def add_report(self, report: Report):
+        """
+        adds a finished forest's report (e.g. from a worker process) to the run's and hands it to the sinks, progress
+        sinks (`progress = True`) only get it when not quiet
+        """
+        self._run.add(report)
+        for sink in self.sinks:
+            if self.quiet and getattr(sink, "progress", False):
+                continue
+            sink.forest(report)
+
+    def take_reports(self) -> list:
+        """
+        the forest reports a worker process collected since the last call, to be passed to `add_report` of the parent
+        """
+        reports, self._pending = self._pending, []
+        return reports
+
+    def finish(self) -> Report:
+        """
+        stops the profiler and hands the run's report (the stages of this process and of every forest, also the ones
+        generated by worker processes) to the sinks
+        """
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(self.profile)
+            self._profiler = None
+        if self.trace_memory and tracemalloc.is_tracing():
+            self._run.peak_mb = tracemalloc.get_traced_memory()[1] / pow(2, 20)
+            tracemalloc.stop()
+        for sink in self.sinks:
+            sink.run(self._run)
+        return self._run
@@ -0,0 +1,86 @@
+import collections
+
+import numpy
+
+from fstools.util import shared_arrays
+
+
+class LabelIndex:
+    def __init__(self, raster: numpy.ndarray, band_rows: int = 1024):
+        """
+        groups the pixels of a label raster by value (in raster order) so each forest only has to look at its own
+        pixels instead of comparing the whole raster against every record id. the raster is read in bands of rows so
+        a memory mapped raster is never loaded as a whole
+        :param raster: the 2d forest raster (infoLayer png or rasterized shp)
+        :param band_rows: number of raster rows sorted at a time
+        """
+        self.shape = raster.shape
+        size = int(numpy.prod(self.shape))
+        bands = [slice(row, row + band_rows) for row in range(0, self.shape[0], band_rows)]
+        counts = collections.Counter()
+        for band in bands:
+            labels, band_counts = numpy.unique(numpy.asarray(raster[band]), return_counts=True)
+            counts.update(dict(zip(labels.tolist(), band_counts.tolist())))
+        self.labels = numpy.array(sorted(counts), dtype=raster.dtype)
+        self._counts = numpy.array([counts[label] for label in self.labels.tolist()], dtype=numpy.int64)
+        self._starts = numpy.cumsum(self._counts) - self._counts
+        self._order = numpy.empty(size, dtype=numpy.int32 if size < 2 ** 31 else numpy.int64)
+        cursor = self._starts.copy()
+        for band in bands:
+            values = numpy.asarray(raster[band]).ravel()
+            order = numpy.argsort(values, kind='stable')
+            positions = numpy.searchsorted(self.labels, values[order])
+            present, first, band_counts = numpy.unique(positions, return_index=True, return_counts=True)
+            offsets = numpy.arange(len(order)) - numpy.repeat(first, band_counts)
+            self._order[cursor[positions] + offsets] = order + band.start * self.shape[1]
+            cursor[present] += band_counts
+
+    def _position(self, label):
+        position = numpy.searchsorted(self.labels, label)
+        if position < len(self.labels) and self.labels[position] == label:
+            return position
+        return None
+
+    def __contains__(self, label) -> bool:
+        return self._position(label) is not None
+
+    def count(self, label) -> int:
+        position = self._position(label)
+        return 0 if position is None else int(self._counts[position])
+
+    def flat_pixels(self, label) -> numpy.ndarray:
+        """
+        flat (row major) raster offsets of a label's pixels, in raster order
+        """
+        position = self._position(label)
+        if position is None:
+            return numpy.empty(0, dtype=self._order.dtype)
+        start = self._starts[position]
+        return self._order[start:start + self._counts[position]]
+
+    def pixels(self, label) -> tuple:
+        """
+        (rows, columns) of a label's pixels, in raster order
+        """
+        return numpy.unravel_index(self.flat_pixels(label), self.shape)
+
+    def bounds(self, label) -> tuple:
+        """
+        bounding box of a label as (first row, last row + 1, first column, last column + 1), None for missing labels
+        """
+        rows, columns = self.pixels(label)
+        if not len(rows):
+            return None
+        return int(rows[0]), int(rows[-1]) + 1, int(columns.min()), int(columns.max()) + 1
+
+    def share(self, directory: str):
+        """
+        moves the pixel order to a memmap in `directory` so pickling the index only sends the file path
+        """
+        self._order = shared_arrays.share(self._order, directory, "label_order")
+
+    def __getstate__(self):
+        return shared_arrays.pack_state(self.__dict__)
+
+    def __setstate__(self, state):
+        self.__dict__.update(shared_arrays.unpack_state(state))
@@ -0,0 +1,57 @@
+import collections
+import copy
+import types
+
+ForestRecord = collections.namedtuple("ForestRecord", ["record"])
+
+_generator = None
+
+
+def portable_record(record) -> ForestRecord:
+    """
+    copies the attributes of a shp/xml record into a plain object that can be sent to a worker process
+    """
+    fields = record.record
+    if hasattr(fields, "as_dict"):
+        fields = fields.as_dict()
+    elif hasattr(fields, "_asdict"):
+        fields = fields._asdict()
+    else:
+        fields = vars(fields)
+    return ForestRecord(record=types.SimpleNamespace(**fields))
+
+
+def _init_worker(generator):
+    global _generator
+    _generator = generator
+    _generator.instrumentation.detach()
+
+
+def _generate_forest(job: tuple) -> tuple:
+    forest = _generator.generate_forest(*job)
+    return forest, _generator.instrumentation.take_reports()
+
+
+def generate_forests(generator, jobs: list, workers: int):
+    """
+    runs `generator.generate_forest` for every job in a process pool, yielding the forests in job order. the raster,
+    DEM and label index are written to a temporary directory and memory mapped by the workers instead of pickled
+    :param generator: the ForestGenerator to run
+    :param jobs: argument tuples for `generate_forest`, the first item being the record
+    :param workers: number of processes
+    """
+    # only imported when forests are generated in parallel, they take longer to import than the rest of the pipeline
+    import multiprocessing
+    import tempfile
+
+    with tempfile.TemporaryDirectory(prefix="fstools_") as directory:
+        shared = copy.copy(generator)
+        shared.share_arrays(directory)
+        jobs = [(portable_record(job[0]),) + tuple(job[1:]) for job in jobs]
+        with multiprocessing.get_context().Pool(workers, initializer=_init_worker, initargs=(shared,)) as pool:
+            for forest, reports in pool.imap(_generate_forest, jobs):
+                # the stage timings and counters of the worker are reported by this process
+                for report in reports:
+                    generator.instrumentation.add_report(report)
+                yield forest
+        del shared
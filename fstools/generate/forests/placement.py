@@ -0,0 +1,84 @@
+import collections
+
+import numpy
+
+from fstools.i18n import _
+
+Placement = collections.namedtuple("Placement", ["translations", "heights", "jitter", "rotations"])
+
+DEM_SCALE = pow(2, 16) / pow(2, 8)
+
+
+def sample_heights(dem: numpy.ndarray, xs: numpy.ndarray, ys: numpy.ndarray) -> numpy.ndarray:
+    """
+    reads the terrain height under each tree, the 3x3 footprint around the pixel has to be on the DEM but only the two
+    upper left samples are averaged (negative indices wrap around like the original per tree lookup)
+    :param dem: the 16 bit height map
+    :param xs: raster row of each tree
+    :param ys: raster column of each tree
+    """
+    xs = numpy.asarray(xs, dtype=numpy.int64)
+    ys = numpy.asarray(ys, dtype=numpy.int64)
+    if len(xs) and (xs.max() + 1 >= dem.shape[0] or ys.max() + 1 >= dem.shape[1]):
+        raise IndexError(_("tree footprint is outside of the DEM"))
+    first = dem[xs - 1, ys - 1].astype(numpy.float64)
+    second = dem[xs - 1, ys].astype(numpy.float64)
+    return (first + second) / 2
+
+
+def transform_trees(xs: numpy.ndarray, ys: numpy.ndarray, dem: numpy.ndarray, raster_shape: tuple,
+                    units_per_pixel: float, jitter_uniforms: numpy.ndarray, rotation_uniforms: numpy.ndarray,
+                    gitter: float = 1.25, z_offset: float = -0.05) -> Placement:
+    """
+    works out the i3d transform of every tree of a forest at once
+    :param xs: raster row of each tree
+    :param ys: raster column of each tree
+    :param dem: the 16 bit height map
+    :param raster_shape: shape of the forest raster, the map is centered on it
+    :param units_per_pixel: the terrain's `unitsPerPixel`
+    :param jitter_uniforms: (n, 2) uniforms of the random offset of each tree, from the tree's random streams
+    :param rotation_uniforms: (n,) uniforms of the yaw of each tree
+    :param gitter: amount of random offset applied to each tree
+    :param z_offset: offset applied to the terrain height
+    :return: a Placement with (n, 3) translations and rotations in i3d order, (n,) heights and (n, 2) jitter
+    """
+    count = len(xs)
+    heights = sample_heights(dem, xs, ys)
+    jitter = numpy.mod(numpy.abs(jitter_uniforms), gitter - gitter * 2)
+    translations = numpy.empty((count, 3), dtype=numpy.float64)
+    translations[:, 0] = (numpy.asarray(ys, dtype=numpy.float64) - raster_shape[0] / 2) * units_per_pixel + jitter[:, 0]
+    translations[:, 1] = heights / DEM_SCALE + z_offset
+    translations[:, 2] = (numpy.asarray(xs, dtype=numpy.float64) - raster_shape[1] / 2) * units_per_pixel + jitter[:, 1]
+    rotations = numpy.zeros((count, 3), dtype=numpy.float64)
+    rotations[:, 1] = numpy.round(numpy.abs(numpy.mod(rotation_uniforms, 360)), 2) - 180
+    return Placement(translations=translations, heights=heights, jitter=jitter, rotations=rotations)
+
+
+def place_points(rows: numpy.ndarray, columns: numpy.ndarray, dem: numpy.ndarray, raster_shape: tuple,
+                 units_per_pixel: float, rotation_uniforms: numpy.ndarray, z_offset: float = -0.05) -> Placement:
+    """
+    the i3d transform of trees at continuous raster positions (e.g. from `poisson.sample_label`), they need no jitter
+    :param rows: raster row of each tree, with its position inside the pixel
+    :param columns: raster column of each tree, with its position inside the pixel
+    :param rotation_uniforms: (n,) uniforms for the yaw
+    """
+    count = len(rows)
+    heights = sample_heights(dem, numpy.floor(rows), numpy.floor(columns))
+    translations = numpy.empty((count, 3), dtype=numpy.float64)
+    translations[:, 0] = (numpy.asarray(columns, dtype=numpy.float64) - raster_shape[0] / 2) * units_per_pixel
+    translations[:, 1] = heights / DEM_SCALE + z_offset
+    translations[:, 2] = (numpy.asarray(rows, dtype=numpy.float64) - raster_shape[1] / 2) * units_per_pixel
+    rotations = numpy.zeros((count, 3), dtype=numpy.float64)
+    rotations[:, 1] = numpy.round(numpy.abs(numpy.mod(rotation_uniforms, 360)), 2) - 180
+    return Placement(translations=translations, heights=heights, jitter=numpy.zeros((count, 2)), rotations=rotations)
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if value.is_integer() else str(value)
+
+
+def format_vectors(vectors: numpy.ndarray) -> list:
+    """
+    turns an (n, 3) array into i3d attribute strings (`"x y z"`)
+    """
+    return [" ".join(map(_format_number, row)) for row in vectors.tolist()]
@@ -0,0 +1,130 @@
+import numpy
+
+from fstools.i18n import _
+
+# cells of the same phase are at least one cell apart, so their candidates can be accepted at the same time
+PHASES = 4
+# minimum distance in pixels, a forest can never hold more trees than it has pixels
+MIN_DISTANCE_PIXELS = 1.5
+
+
+def distance_table(catalogue, spacing=4.0) -> numpy.ndarray:
+    """
+    the minimum distance (in map units) around a tree of every species and stage
+    :param catalogue: the TreeCatalogue
+    :param spacing: a distance for every tree, or a dict of species key (`pine`) to a distance or to a dict of stage
+    age to distance. species and stages that are not listed get the `"default"` entry (4.0 when missing)
+    :return: a (species, stages) array, indexed like `ForestInstances.species` and `.stages`
+    """
+    if not isinstance(spacing, dict):
+        spacing = {"default": spacing}
+    default = float(spacing.get("default", 4.0))
+    table = numpy.full((len(catalogue), max([1] + [len(tree.stages) for tree in catalogue])), default)
+    for index, tree in enumerate(catalogue):
+        distances = spacing.get(tree.key, default)
+        for stage_index, stage in enumerate(tree.stages):
+            if isinstance(distances, dict):
+                value = distances.get(stage.age, distances.get(str(stage.age), distances.get("default", default)))
+            else:
+                value = distances
+            table[index, stage_index] = float(value)
+    assert (table > 0).all(), _("tree spacing has to be above 0")
+    return table
+
+
+def _neighbor_cells(cells: numpy.ndarray, width: int) -> numpy.ndarray:
+    """
+    the index of the 3x3 neighborhood of every occupied cell, `len(cells)` (an empty cell) where it isn't occupied
+    """
+    offsets = numpy.array([row * width + column for row in (-1, 0, 1) for column in (-1, 0, 1)], dtype=numpy.int64)
+    keys = cells[:, None] + offsets
+    found = numpy.minimum(numpy.searchsorted(cells, keys), len(cells) - 1)
+    return numpy.where(cells[found] == keys, found, len(cells))
+
+
+def blue_noise(points: numpy.ndarray, radii: numpy.ndarray) -> numpy.ndarray:
+    """
+    dart throwing on a spatial hash: the candidates are taken in order and each is accepted when no accepted point is
+    closer than the larger of the two radii. the grid cells are as large as the largest radius, so a candidate is only
+    compared with the points of its 3x3 cells, and one candidate of every cell of the same phase is tested at once,
+    which keeps the run time linear in the number of candidates
+    :param points: (n, 2) candidate positions, in the order they are tried (shuffle them first)
+    :param radii: (n,) minimum distance of each candidate, in the units of the points
+    :return: a boolean array of the accepted candidates
+    """
+    count = len(points)
+    keep = numpy.zeros(count, dtype=bool)
+    if not count:
+        return keep
+    cell_size = float(radii.max())
+    cells = numpy.floor(points / cell_size).astype(numpy.int64)
+    cells -= cells.min(axis=0) - 1
+    width = int(cells[:, 1].max()) + 2
+    keys = cells[:, 0] * width + cells[:, 1]
+    # stable, so the candidates of a cell keep their order
+    order = numpy.argsort(keys, kind='stable')
+    unique, first, sizes = numpy.unique(keys[order], return_index=True, return_counts=True)
+    cell_of = numpy.repeat(numpy.arange(len(unique)), sizes)
+    rank = numpy.arange(count) - numpy.repeat(first, sizes)
+    neighbors = _neighbor_cells(unique, width)
+    phase = (unique // width % 2) * 2 + unique % width % 2
+    # a square as large as the smallest radius holds at most 4 points that are a radius apart
+    capacity = int(numpy.ceil(cell_size / radii.min() + 1) ** 2)
+    # x, y and squared radius of the accepted points per cell, empty slots are infinitely far away
+    slots = numpy.full((3, len(unique) + 1, capacity), numpy.inf)
+    slots[2] = 0
+    filled = numpy.zeros(len(unique) + 1, dtype=numpy.int64)
+    steps = rank * PHASES + phase[cell_of]
+    by_step = numpy.argsort(steps, kind='stable')
+    bounds = numpy.flatnonzero(numpy.diff(steps[by_step])) + 1
+    for group in numpy.split(by_step, bounds):
+        candidates = order[group]
+        cell = cell_of[group]
+        around = neighbors[cell]
+        x = slots[0][around].reshape(len(cell), -1) - points[candidates, :1]
+        y = slots[1][around].reshape(len(cell), -1) - points[candidates, 1:]
+        squared = radii[candidates, None] ** 2
+        limits = numpy.maximum(slots[2][around].reshape(len(cell), -1), squared)
+        clear = ~(x * x + y * y < limits).any(axis=1)
+        clear &= filled[cell] < capacity
+        cell, candidates = cell[clear], candidates[clear]
+        slots[0, cell, filled[cell]] = points[candidates, 0]
+        slots[1, cell, filled[cell]] = points[candidates, 1]
+        slots[2, cell, filled[cell]] = squared[clear, 0]
+        filled[cell] += 1
+        keep[candidates] = True
+    return keep
+
+
+def sample_label(pixels: numpy.ndarray, width: int, distances: numpy.ndarray, probabilities, stage_table,
+                 rng: numpy.random.Generator, attempts: float = 10, density: float = 1.0) -> tuple:
+    """
+    blue noise trees inside a label: candidates are spread over the label's pixels, get a species and stage and are
+    thinned to their minimum distances with `blue_noise`
+    :param pixels: the label's flat pixel offsets
+    :param width: raster width
+    :param distances: minimum distances in pixels, see `distance_table`
+    :param probabilities: species weights
+    :param stage_table: the record's StageTable
+    :param rng: the forest's generator
+    :param attempts: candidates per square of the smallest distance, more fill the label more evenly
+    :param density: density multiplier, the distances are scaled by `1 / sqrt(density)`
+    :return: (n, 2) row/column positions (pixel units), species, stages and (n,) yaw uniforms of the trees
+    """
+    scale = 1 / numpy.sqrt(max(density, 1e-6))
+    smallest = max(float(distances.min()) * scale, MIN_DISTANCE_PIXELS)
+    count = int(numpy.ceil(len(pixels) * attempts / smallest ** 2))
+    candidate_pixels = pixels[rng.integers(0, len(pixels), count)] if len(pixels) else pixels[:0]
+    positions = numpy.empty((count, 2), dtype=numpy.float64)
+    positions[:, 0] = candidate_pixels // width
+    positions[:, 1] = candidate_pixels % width
+    positions += rng.random((count, 2))
+    cdf = numpy.cumsum(numpy.asarray(probabilities, dtype=numpy.float64))
+    species = numpy.minimum(numpy.searchsorted(cdf / cdf[-1], rng.random(count), side='right'), len(cdf) - 1)
+    stage_uniforms = rng.random(count)
+    available = stage_table.available(species)
+    positions, species, stage_uniforms = positions[available], species[available], stage_uniforms[available]
+    stages = stage_table.pick(species, stage_uniforms)
+    radii = numpy.maximum(distances[species, stages] * scale, MIN_DISTANCE_PIXELS)
+    keep = blue_noise(positions, radii)
+    return positions[keep], species[keep].astype(numpy.int16), stages[keep], rng.random(int(keep.sum()))
@@ -0,0 +1,74 @@
+import numpy
+
+
+def _box_sum(values: numpy.ndarray, distance: int, axis: int, wrap: bool = True) -> numpy.ndarray:
+    """
+    sums a window of `2 * distance + 1` cells along one axis with a running (summed area) total
+    :param values: integer array to sum
+    :param distance: number of cells either side of the center to include
+    :param axis: the axis to sum along
+    :param wrap: mimic python indexing at the lower edge (index -1 is the last cell), the upper edge is always cut off
+    """
+    size = values.shape[axis]
+    wrapped = numpy.arange(max(-distance, -size if wrap else 0), 0)
+    pad_shape = list(values.shape)
+    pad_shape[axis] = distance - len(wrapped)
+    before = numpy.zeros(pad_shape, dtype=values.dtype)
+    pad_shape[axis] = distance
+    after = numpy.zeros(pad_shape, dtype=values.dtype)
+    padded = numpy.concatenate([before, numpy.take(values, wrapped, axis=axis), values, after], axis=axis)
+    pad_shape[axis] = 1
+    summed = numpy.concatenate([numpy.zeros(pad_shape, dtype=numpy.int32),
+                                numpy.cumsum(padded, axis=axis, dtype=numpy.int32)], axis=axis)
+    window = 2 * distance + 1
+    upper = numpy.take(summed, numpy.arange(window, window + size), axis=axis)
+    lower = numpy.take(summed, numpy.arange(0, size), axis=axis)
+    return upper - lower
+
+
+def count_neighbors(arr: numpy.ndarray, distance: int = 2, wrap: tuple = (True, True)) -> numpy.ndarray:
+    """
+    counts the occupied (> 0) cells in the square window around every cell, the cell itself included
+    :param arr: 2d array where values above 0 are occupied
+    :param distance: half width of the window in cells
+    :param wrap: per axis, whether the lower edge wraps around to the end of the array like the original per cell loop
+    """
+    occupied = (numpy.asarray(arr) > 0).astype(numpy.int32)
+    rows = _box_sum(occupied, distance, axis=0, wrap=wrap[0])
+    return _box_sum(rows, distance, axis=1, wrap=wrap[1])
+
+
+def prune_neighbors(arr: numpy.ndarray, distance: int = 2, threshold: int = 1,
+                    wrap: tuple = (True, True)) -> numpy.ndarray:
+    """
+    keeps the occupied cells that have more than `threshold` occupied cells (itself included) within `distance`
+    :param arr: 2d array where values above 0 are occupied
+    :param distance: half width of the window in cells
+    :param threshold: cells with this many or fewer occupied cells in their window are dropped
+    :param wrap: per axis, whether the lower edge wraps around to the end of the array
+    :return: a boolean array of the cells to keep
+    """
+    counts = count_neighbors(arr, distance=distance, wrap=wrap)
+    return (numpy.asarray(arr) > 0) & (counts > threshold)
+
+
+def pruning_window(bounds: tuple, shape: tuple, distance: int = 2) -> tuple:
+    """
+    finds the part of a raster that has to be pruned for a single label to get the same result as pruning the whole
+    raster with everything outside the label empty. an axis only needs the full raster (and wrapping) when the label
+    touches both ends of it within `distance`
+    :param bounds: (first row, last row + 1, first column, last column + 1) of the label
+    :param shape: shape of the full raster
+    :param distance: half width of the pruning window in cells
+    :return: the (row, column) slices of the window and whether each axis wraps
+    """
+    slices = []
+    wrap = []
+    for start, stop, size in ((bounds[0], bounds[1], shape[0]), (bounds[2], bounds[3], shape[1])):
+        if start < distance and stop > size - distance:
+            slices.append(slice(0, size))
+            wrap.append(True)
+        else:
+            slices.append(slice(start, stop))
+            wrap.append(False)
+    return tuple(slices), tuple(wrap)
@@ -1,8 +1,10 @@
+import argparse
 import os
 from pathlib import Path
 
 from fstools.generate.forests.forestGenerator import ForestGenerator
-from fstools.util import i3d
+from fstools.generate.forests.instrumentation import ConsoleSink, Instrumentation, JsonLogSink
+from fstools.util.disk_cache import DiskCache
 
 if __name__ == "__main__":
     # change this if you named your base treeset something other than baseTrees (case counts)
@@ -27,10 +29,31 @@ if __name__ == "__main__":
     xml_fn = Path(r"C:\MyMods\MyModMap\maps\xml\forests.xml")
 
     # don't change things below here
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-cache", action="store_true", help="decode the rasters and parse the i3d without the cache")
+    parser.add_argument("--clear-cache", action="store_true", help="empty the cache before loading")
+    parser.add_argument("--cache-dir", default=None, help="cache directory (FSTOOLS_CACHE_DIR or the user cache)")
+    parser.add_argument("--placement", choices=("grid", "poisson"), default="grid",
+                        help="grid: pixel mask with pruning and thinning, poisson: blue noise with --spacing between trees")
+    parser.add_argument("--spacing", type=float, default=4.0, help="minimum distance between trees (poisson placement)")
+    parser.add_argument("--quiet", action="store_true", help="no per forest output, only warnings and the timings")
+    parser.add_argument("--stats-log", default=None, help="append the per forest timings and counters as json lines")
+    parser.add_argument("--profile", default=None, help="write a cProfile of the run to this file")
+    parser.add_argument("--trace-memory", action="store_true", help="record the peak python allocations per forest")
+    options = parser.parse_args()
+    cache = False if options.no_cache else DiskCache(options.cache_dir)
+    if options.clear_cache:
+        DiskCache(options.cache_dir).clear()
+    sinks = [ConsoleSink()] + ([JsonLogSink(options.stats_log)] if options.stats_log else [])
+    instrumentation = Instrumentation(sinks=sinks, quiet=options.quiet, profile=options.profile,
+                                      trace_memory=options.trace_memory)
     print("loading...")
-    fg = ForestGenerator(i3d_file, i3d_tree_sources, rasterized, shp, xml_raster_metadata=xml_fn)
+    fg = ForestGenerator(i3d_file, i3d_tree_sources, rasterized, shp, xml_raster_metadata=xml_fn, cache=cache,
+                         instrumentation=instrumentation)
+    fg.placement = options.placement
+    fg.spacing = options.spacing
     print("running generation")
-    fg.run()
     target_fn = os.path.join(os.path.dirname(i3d_file), os.path.basename(i3d_file))
-    i3d.write(i3d_contents=fg.i3d_data.data, path=target_fn)
+    fg.write(target_fn, forests=fg.iter_forests())
+    instrumentation.finish()
     print(f"Done! wrote to {target_fn}")
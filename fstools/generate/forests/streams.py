@@ -0,0 +1,63 @@
+import collections
+
+import numpy
+
+# one independent stream per random decision, so a value only depends on the position of its pixel or tree
+THINNING_PERCENT, OCCUPANCY, SPECIES, STAGE, JITTER, ROTATION, THINNING, POISSON = range(8)
+
+TreeUniforms = collections.namedtuple("TreeUniforms", ["thinning", "jitter", "rotation", "stage"])
+
+
+class RandomStreams:
+    def __init__(self, seed: int, key: int):
+        """
+        random uniforms that can be read from any position, so a forest generated in tiles draws exactly the same
+        values as one generated in a single pass
+        :param seed: the run's seed
+        :param key: identifies the forest (the record id)
+        """
+        self.seed = int(seed)
+        self.key = int(key)
+
+    def generator(self, stream: int) -> numpy.random.Generator:
+        """
+        a generator of its own for a stream that is drawn in a single pass
+        """
+        return numpy.random.Generator(numpy.random.PCG64([self.seed, self.key, stream]))
+
+    def uniform(self, stream: int, start: int, count: int, width: int = 1) -> numpy.ndarray:
+        """
+        the uniforms [0, 1) of elements `start` to `start + count` of a stream, `width` values per element
+        :return: a (count,) array, (count, width) when width is above 1
+        """
+        bit_generator = numpy.random.PCG64([self.seed, self.key, stream])
+        # every double is a single 64 bit draw
+        bit_generator.advance(start * width)
+        values = numpy.random.Generator(bit_generator).random(count * width)
+        return values.reshape(count, width) if width > 1 else values
+
+    def integers(self, stream: int, start: int, high, count: int = None) -> numpy.ndarray:
+        """
+        integers in [0, high) from the uniforms of a stream, `high` may be an array with a bound per element
+        """
+        count = len(high) if count is None else count
+        return numpy.floor(self.uniform(stream, start, count) * high).astype(numpy.int64)
+
+    def choice(self, stream: int, start: int, probabilities, count: int) -> numpy.ndarray:
+        """
+        indices drawn with the given probabilities, like `Generator.choice(len(probabilities), count, p=...)`
+        """
+        cdf = numpy.cumsum(numpy.asarray(probabilities, dtype=numpy.float64))
+        cdf /= cdf[-1]
+        picks = numpy.searchsorted(cdf, self.uniform(stream, start, count), side='right')
+        return numpy.minimum(picks, len(cdf) - 1)
+
+    def trees(self, start: int, count: int) -> TreeUniforms:
+        """
+        every per tree uniform of trees `start` to `start + count` in one batch: (n,) thinning, (n, 2) jitter,
+        (n,) rotation and (n,) stage
+        """
+        return TreeUniforms(thinning=self.uniform(THINNING, start, count),
+                            jitter=self.uniform(JITTER, start, count, width=2),
+                            rotation=self.uniform(ROTATION, start, count),
+                            stage=self.uniform(STAGE, start, count))
@@ -1,6 +1,9 @@
 import collections
+import os
+from xml.parsers import expat
 
-from fstools.util.i3d import TransformGroup
+from fstools.generate.forests.parallel import ForestRecord
+from fstools.util.i3d import TransformGroup, read
 
 
 def cast_to_float(val: str):
@@ -47,18 +50,80 @@ class XmlMetadata(TransformGroup):
 
 class XmlForests(TransformGroup):
     def __init__(self, xml_data: dict = None, xml_file: str = None):
-        super().__init__(xml_data, xml_file)
+        """
+        the <forest> entries of a forests.xml
+        :param xml_data: the parsed document, the file is only read when it is needed otherwise
+        :param xml_file: the forests.xml
+        """
+        super().__init__(xml_data)
+        self.file = xml_file
         self.default_label = "forest"
 
     def forests(self, target='forest'):
+        if self.data is None:
+            self.data = read(self.file)
         forests = self.get_transform_group(data=self.data, target=target)
         assert len(forests) > 0, "no forest entries found in xml file, see example document"
         for forest in forests[0]:
             yield XmlMetadata(data=forest)
 
-    def get_records(self):
-        return self.forests()
+    def get_records(self) -> list:
+        """
+        the forests as typed records, see `read_records`
+        """
+        if self.data is None:
+            return read_records(self.file)
+        forests = self.get_transform_group(data=self.data, target=self.default_label)
+        assert len(forests) > 0, "no forest entries found in xml file, see example document"
+        entries = forests[0] if isinstance(forests[0], list) else [forests[0]]
+        return _records([{k.lstrip(self._prefix): v for k, v in entry.items() if self._prefix in k}
+                         for entry in entries])
 
     @property
     def shape(self):
         return {}
+
+
+def _records(entries: list) -> list:
+    # one namedtuple class per set of attributes, so an attribute an entry doesn't have still raises AttributeError
+    classes = {}
+    records = []
+    for entry in entries:
+        fields = tuple(entry)
+        if fields not in classes:
+            classes[fields] = collections.namedtuple("Record", fields, rename=True)
+        records.append(ForestRecord(record=classes[fields](*[cast_to_float(value) for value in entry.values()])))
+    return records
+
+
+def _scan_forests(path: str) -> list:
+    entries = []
+
+    def start(tag, attributes):
+        if tag == "forest":
+            entries.append(attributes)
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start
+    with open(path, "rb") as fi:
+        parser.ParseFile(fi)
+    return entries
+
+
+_cache = {}
+
+
+def read_records(path: str) -> list:
+    """
+    reads the <forest> entries of a forests.xml in a single pass. every entry becomes a namedtuple record of its own
+    attributes, entries with the same attributes share the class, numbers are converted once while reading. the
+    records are cached until the file changes
+    """
+    path = os.path.abspath(os.fspath(path))
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    if path not in _cache or _cache[path][0] != version:
+        entries = _scan_forests(path)
+        assert entries, "no forest entries found in xml file, see example document"
+        _cache[path] = (version, _records(entries))
+    return list(_cache[path][1])
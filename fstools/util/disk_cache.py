@@ -0,0 +1,163 @@
+import hashlib
+import os
+import pickle
+import shutil
+
+import numpy
+
+from fstools.i18n import _
+
+DEFAULT_MAX_BYTES = 4 * pow(2, 30)
+# part of every key, bump when the pickled classes (LazyI3d, NodeIndex, ...) or the decoded arrays change so entries
+# written by an older version are missed instead of loaded
+CACHE_FORMAT = 1
+
+
+def default_directory() -> str:
+    """
+    `$FSTOOLS_CACHE_DIR`, else `fstools` in the user's cache directory
+    """
+    if os.environ.get("FSTOOLS_CACHE_DIR"):
+        return os.environ["FSTOOLS_CACHE_DIR"]
+    base = os.environ.get("XDG_CACHE_HOME") or os.environ.get("LOCALAPPDATA") or os.path.join("~", ".cache")
+    return os.path.join(os.path.expanduser(base), "fstools")
+
+
+def file_digest(path: str, block_size: int = pow(2, 20)) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fi:
+        for block in iter(lambda: fi.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    def __init__(self, directory: str = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        keeps artifacts derived from source files (decoded rasters, parsed i3d documents) between runs. entries are
+        keyed by the source's path, mtime, size and content hash and by `CACHE_FORMAT`, so neither an edited source
+        nor an entry of an older fstools version is served from the cache. the least recently used entries are
+        removed once the cache grows past `max_bytes`
+        :param directory: where the entries are stored, see `default_directory`
+        :param max_bytes: size the cache is trimmed to after every store
+        """
+        self.directory = os.fspath(directory or default_directory())
+        self.max_bytes = max_bytes
+        self.__digests = {}
+
+    def key(self, path: str, kind: str, *extra) -> str:
+        """
+        the entry name of an artifact of `path`
+        :param kind: the type of artifact
+        :param extra: anything else the artifact depends on (it has to have a stable repr)
+        """
+        path = os.path.abspath(os.fspath(path))
+        stat = os.stat(path)
+        source = (path, stat.st_mtime_ns, stat.st_size)
+        if source not in self.__digests:
+            self.__digests[source] = file_digest(path)
+        key = repr((CACHE_FORMAT, kind, source, self.__digests[source], extra)).encode("utf-8")
+        return f"{kind}-{hashlib.sha256(key).hexdigest()}"
+
+    def _entry(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _hit(self, entry: str) -> bool:
+        if not os.path.exists(entry):
+            return False
+        # the modification time orders the entries for eviction
+        os.utime(entry)
+        return True
+
+    def _store(self, entry: str, write: callable):
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = f"{entry}.{os.getpid()}.tmp"
+        try:
+            with open(temporary, "wb") as fo:
+                write(fo)
+            os.replace(temporary, entry)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        self.evict(keep=(entry,))
+
+    def array(self, path: str, loader: callable, *extra) -> numpy.ndarray:
+        """
+        an array decoded from `path` as a read only memmap of its cached `.npy`
+        :param loader: decodes the source, called with `path` and `extra` on a miss
+        """
+        entry = self._entry(self.key(path, "array", *extra) + ".npy")
+        if not self._hit(entry):
+            array = numpy.asarray(loader(path, *extra))
+            self._store(entry, lambda fo: numpy.save(fo, array))
+            del array
+        return numpy.load(entry, mmap_mode='r')
+
+    def pickled(self, path: str, loader: callable, *extra):
+        """
+        an object built from `path`, stored with pickle
+        :param loader: builds the object, called with `path` and `extra` on a miss
+        """
+        entry = self._entry(self.key(path, "pickle", *extra) + ".pickle")
+        if self._hit(entry):
+            with open(entry, "rb") as fi:
+                return pickle.load(fi)
+        value = loader(path, *extra)
+        self._store(entry, lambda fo: pickle.dump(value, fo, protocol=pickle.HIGHEST_PROTOCOL))
+        return value
+
+    def entries(self) -> list:
+        """
+        (modification time, size, path) of every entry, least recently used first
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        return sorted(entries)
+
+    def size(self) -> int:
+        return sum(size for _mtime, size, _path in self.entries())
+
+    def evict(self, keep: tuple = ()):
+        """
+        removes the least recently used entries until the cache fits in `max_bytes`
+        """
+        entries = self.entries()
+        total = sum(size for _mtime, size, _path in entries)
+        for _mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path in keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                # still mapped by another process (windows)
+                continue
+            total -= size
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+
+
+def main(args: list = None):
+    # argparse pulls in gettext, it is only needed on the command line
+    import argparse
+
+    parser = argparse.ArgumentParser(description=_("inspect or clear the fstools cache"))
+    parser.add_argument("--cache-dir", default=None, help=_("cache directory, $FSTOOLS_CACHE_DIR or the user's cache directory by default"))
+    parser.add_argument("--clear", action="store_true", help=_("remove every entry"))
+    options = parser.parse_args(args)
+    cache = DiskCache(options.cache_dir)
+    if options.clear:
+        cache.clear()
+    print(_("{}: {} entries, {:.1f} MB").format(cache.directory, len(cache.entries()), cache.size() / pow(2, 20)))
+
+
+if __name__ == "__main__":
+    main()
@@ -9,21 +9,78 @@ def read(func, path, *args, **kwargs):
     return func(path, *args, **kwargs)
 
 
-def write(func: callable, path: str, overwrite: bool = False, *args, **kwargs):
-    _exists = os.path.exists(path)
+def temporary_path(path: str) -> str:
+    """
+    a file next to `path` to write to before it is moved into place, the extension is kept for writers that pick the
+    format from it
+    """
+    directory, name = os.path.split(os.fspath(path))
+    stem, extension = os.path.splitext(name)
+    return os.path.join(directory, f".{stem}.{os.getpid()}.tmp{extension}")
+
+
+def _fsync(path: str):
+    # flushing needs write access on windows (FlushFileBuffers), a read only descriptor fails there
+    descriptor = os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def _fsync_directory(path: str):
+    """
+    makes the rename durable where the platform supports it, directories can't be opened or flushed on windows
+    """
+    try:
+        descriptor = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(descriptor)
+
+
+def _backup(path: str):
+    """
+    keeps the current file as `<path>.bak`, a hardlink where the file system supports it so nothing is copied
+    """
     _bak = path + ".bak"
+    if os.path.lexists(_bak):
+        os.remove(_bak)
+    try:
+        os.link(path, _bak)
+    except (OSError, AttributeError, NotImplementedError):
+        shutil.copy2(path, _bak)
+
+
+def write(func: callable, path: str, overwrite: bool = False, *args, backup: bool = False, **kwargs):
+    """
+    writes a file atomically: `func(temporary_path, *args, **kwargs)` writes a temporary file in the same directory,
+    which is flushed to disk and then moved over `path`, so `path` is either the old or the complete new file even
+    if writing fails or the process is killed
+    :param func: writes the file to the path it is given
+    :param path: the file to write
+    :param overwrite: replace `path` when it exists
+    :param backup: keep the file that is replaced as `<path>.bak`
+    :return: what `func` returns
+    """
+    path = os.fspath(path)
+    _exists = os.path.exists(path)
     if _exists and not overwrite is True:
         raise AssertionError(f"`{path}`" + _(" exists but not permitted to overwrite"))
-    if os.path.exists(_bak):
-        os.remove(_bak)
+    temporary = temporary_path(path)
     try:
-        shutil.move(path, _bak)
-        resp = func(path, *args, **kwargs)
-    except Exception as exc:
-        if _exists:
-            shutil.copy2(_bak, path)
-        raise
+        resp = func(temporary, *args, **kwargs)
+        _fsync(temporary)
+        if _exists and backup:
+            _backup(path)
+        os.replace(temporary, path)
     finally:
-        if _exists:
-            os.remove(_bak)
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    _fsync_directory(os.path.dirname(os.path.abspath(path)))
     return resp
@@ -1,7 +1,31 @@
 import collections
 import os
+from xml.parsers import expat
 
-from xmltodict import parse, unparse
+from fstools.i18n import _
+from fstools.util import generic_io
+
+
+ElementSpan = collections.namedtuple("ElementSpan", ["tag", "start", "end", "depth"])
+
+_ATTRIBUTE_ENTITIES = {"\n": "&#10;", "\r": "&#13;", "\t": "&#9;"}
+
+
+# xml.sax.saxutils' escaping, it isn't imported because it pulls in urllib and http.client
+def escape(data: str, entities: dict = None) -> str:
+    data = data.replace("&", "&amp;").replace(">", "&gt;").replace("<", "&lt;")
+    for character, entity in (entities or {}).items():
+        data = data.replace(character, entity)
+    return data
+
+
+def quoteattr(data: str, entities: dict = None) -> str:
+    data = escape(data, dict(entities or {}, **_ATTRIBUTE_ENTITIES))
+    if '"' in data:
+        if "'" in data:
+            return '"{}"'.format(data.replace('"', "&quot;"))
+        return "'{}'".format(data)
+    return '"{}"'.format(data)
 
 
 def map_to_key(obj: dict, key: str, callback: callable, parents: list = None):
@@ -22,6 +46,17 @@ def map_to_key(obj: dict, key: str, callback: callable, parents: list = None):
                 map_to_key(record, key, callback, parents=new_parents)
 
 
+def parse(*args, **kwargs):
+    # xmltodict is only imported once a document is parsed or written
+    import xmltodict
+    return xmltodict.parse(*args, **kwargs)
+
+
+def unparse(*args, **kwargs):
+    import xmltodict
+    return xmltodict.unparse(*args, **kwargs)
+
+
 def read(path: str, *args, **kwargs) -> dict:
     with open(path, "r") as fi:
         contents = fi.read()
@@ -29,18 +64,334 @@ def read(path: str, *args, **kwargs) -> dict:
     return source_i3d
 
 
-def write(i3d_contents: dict, path: str, *args, **kwargs):
-    with open(path, "w") as fo:
-        unparse(i3d_contents, output=fo, pretty=True, indent=' ', *args, **kwargs)
+def write(i3d_contents: dict, path: str, *args, backup: bool = False, **kwargs):
+    """
+    writes a document atomically (see `generic_io.write`), `backup` keeps the replaced file as `<path>.bak`
+    """
+    if isinstance(i3d_contents, PartialDocument):
+        raise AssertionError(_("the i3d was read lazily and only holds part of the map, write it with "
+                               "`i3d.write_stream` or `ForestGenerator.write` (or read it with lazy_i3d=False)"))
+
+    def _write(_path):
+        with open(_path, "w") as fo:
+            unparse(i3d_contents, output=fo, pretty=True, indent=' ', *args, **kwargs)
+
+    generic_io.write(_write, path, overwrite=True, backup=backup)
 
 
-def get_for_type(type: str, i3d: dict) -> list:
+class _SpansFound(Exception):
+    pass
+
+
+class PartialDocument(collections.OrderedDict):
+    """
+    the skeleton document of a LazyI3d, writing it with `write` would drop everything that wasn't materialized
+    """
+
+
+def find_elements(path: str, names: list) -> tuple:
+    """
+    finds the elements with the given `name` attributes without building a tree, parsing stops once all are found
+    :param path: the i3d file
+    :param names: values of the `name` attribute to look for (first match wins)
+    :return: the document encoding and a dict of name to ElementSpan, `end` is the byte offset of the end tag or, for
+    an empty element, the offset just after it
+    """
+    wanted = set(names)
+    spans = {}
+    open_elements = []
+    parser = expat.ParserCreate()
+    encoding = ["utf-8"]
+
+    def declaration(version, declared_encoding, standalone):
+        if declared_encoding:
+            encoding[0] = declared_encoding
+
+    def start(tag, attributes):
+        name = attributes.get("name")
+        if name in wanted and name not in spans:
+            open_elements.append((name, tag, parser.CurrentByteIndex))
+        else:
+            open_elements.append(None)
+
+    def end(tag):
+        element = open_elements.pop()
+        if element is not None:
+            name, tag, offset = element
+            spans[name] = ElementSpan(tag=tag, start=offset, end=parser.CurrentByteIndex, depth=len(open_elements))
+            if len(spans) == len(wanted):
+                raise _SpansFound()
+
+    parser.XmlDeclHandler = declaration
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    with open(path, "rb") as fi:
+        try:
+            parser.ParseFile(fi)
+        except _SpansFound:
+            pass
+    return encoding[0], spans
+
+
+def _read_tag(fi, offset: int) -> bytes:
+    """
+    reads the tag starting at `offset` up to and including its closing `>` (skipping any inside quoted values)
+    """
+    fi.seek(offset)
+    tag = bytearray()
+    quote = None
+    while True:
+        chunk = fi.read(4096)
+        assert chunk, "unterminated tag at byte {}".format(offset)
+        for index, char in enumerate(chunk):
+            if quote:
+                if char == quote:
+                    quote = None
+            elif char in b"\"'":
+                quote = char
+            elif char == ord(">"):
+                tag.extend(chunk[:index + 1])
+                return bytes(tag)
+        tag.extend(chunk)
+
+
+def _element_end(fi, start: int, end: int) -> tuple:
+    """
+    :param start: offset of the element's start tag
+    :param end: the offset expat reports at the end of the element
+    :return: the start tag, whether the element is empty (`<tag/>`) and the offset just after the element
+    """
+    start_tag = _read_tag(fi, start)
+    if start_tag.endswith(b"/>"):
+        return start_tag, True, start + len(start_tag)
+    return start_tag, False, end + len(_read_tag(fi, end))
+
+
+def _copy_bytes(fi, fo, start: int, stop: int, chunk_size: int = 1 << 20):
+    fi.seek(start)
+    remaining = stop - start
+    while remaining > 0:
+        chunk = fi.read(min(chunk_size, remaining))
+        assert chunk, "source ended early"
+        fo.write(chunk)
+        remaining -= len(chunk)
+
+
+def _indentation(fi, span: ElementSpan, default: str) -> tuple:
+    """
+    works out the indentation in front of an element and the indentation per level used by the file
+    """
+    fi.seek(max(0, span.start - 1024))
+    line = fi.read(span.start - fi.tell()).rsplit(b"\n", 1)[-1].decode("latin-1")
+    if line.strip(" \t"):
+        return default * span.depth, default
+    if span.depth and line and len(line) % span.depth == 0:
+        return line, line[:len(line) // span.depth]
+    return line, default
+
+
+def _child_nodes(value):
+    if value is None or isinstance(value, (dict, str)):
+        return [value]
+    return value
+
+
+def emit_node(write: callable, label: str, node, prefix: str = "", indent: str = " ", newline: str = "\n",
+              attr_prefix: str = "@", cdata_key: str = "#text"):
+    """
+    writes an xmltodict style node as (pretty) xml through `write`, child lists may be generators so arbitrarily
+    large subtrees can be written without holding them in memory
+    :param write: called with each piece of text
+    :param label: the element name
+    :param node: dict of `@attributes`, `#text` and child elements (a dict, list/iterable of dicts, string or None)
+    :param prefix: indentation of this element
+    :param indent: added to the prefix per level
+    :param newline: line ending
+    """
+    if node is None or isinstance(node, str):
+        node = {} if node is None else {cdata_key: node}
+    start = prefix + "<" + label + "".join(
+        " {}={}".format(key[len(attr_prefix):], quoteattr("" if value is None else str(value), _ATTRIBUTE_ENTITIES))
+        for key, value in node.items() if key.startswith(attr_prefix)
+    )
+    text = node.get(cdata_key)
+    text = escape(str(text)) if text is not None else ""
+    opened = False
+    for key, value in node.items():
+        if key.startswith(attr_prefix) or key == cdata_key:
+            continue
+        for child in _child_nodes(value):
+            if not opened:
+                write(start + ">" + text)
+                opened = True
+            write(newline)
+            emit_node(write, key, child, prefix=prefix + indent, indent=indent, newline=newline,
+                      attr_prefix=attr_prefix, cdata_key=cdata_key)
+    if opened:
+        write(newline + prefix + "</" + label + ">")
+    elif text:
+        write(start + ">" + text + "</" + label + ">")
+    else:
+        write(start + "/>")
+
+
+def write_stream(source: str, path: str, replacements: dict, indent: str = " ", label: str = "TransformGroup",
+                 backup: bool = False):
+    """
+    writes a copy of the source i3d to `path` where the children of the named elements are replaced. everything else
+    is copied byte for byte and the new children are written as they are produced, so memory does not grow with the
+    number of nodes. `path` may be the source itself, the file is only replaced once it has been fully written (see
+    `generic_io.write`)
+    :param source: the original i3d file
+    :param path: where to write the result
+    :param replacements: {value of the name attribute: iterable of child nodes (xmltodict style dicts)}
+    :param indent: added per level of the new children
+    :param label: element name of the new children
+    :param backup: keep the replaced file as `<path>.bak`
+    """
+    encoding, spans = find_elements(source, list(replacements))
+    missing = set(replacements) - set(spans)
+    assert not missing, "elements not found in i3d: {}".format(", ".join(sorted(missing)))
+    def _write(_path):
+        _write_replaced(source, _path, spans, encoding, replacements, indent, label)
+
+    generic_io.write(_write, path, overwrite=True, backup=backup)
+
+
+def _write_replaced(source: str, path: str, spans: dict, encoding: str, replacements: dict, indent: str, label: str):
+    with open(source, "rb") as fi, open(path, "wb") as fo:
+        newline = "\r\n" if b"\r\n" in fi.read(4096) else "\n"
+
+        def write(text: str):
+            fo.write(text.encode(encoding, "xmlcharrefreplace"))
+
+        position = 0
+        for name, span in sorted(spans.items(), key=lambda item: item[1].start):
+            assert span.start >= position, "nested replacements are not supported ({})".format(name)
+            _copy_bytes(fi, fo, position, span.start)
+            start_tag, empty, position = _element_end(fi, span.start, span.end)
+            fo.write(start_tag[:-2].rstrip() + b">" if empty else start_tag)
+            prefix, unit = _indentation(fi, span, indent)
+            for child in replacements[name]:
+                write(newline)
+                emit_node(write, label, child, prefix=prefix + unit, indent=unit, newline=newline)
+            write(newline + prefix + "</" + span.tag + ">")
+        _copy_bytes(fi, fo, position, os.path.getsize(source))
+
+
+def _add_child(parent: dict, tag: str, child):
+    if tag not in parent:
+        parent[tag] = child
+    elif isinstance(parent[tag], list):
+        parent[tag].append(child)
+    else:
+        parent[tag] = [parent[tag], child]
+
+
+class LazyI3d:
+    default_subtrees = ("Files", "TerrainTransformGroup", "baseTrees", "autoForests")
+
+    def __init__(self, path: str, subtrees: tuple = None):
+        """
+        reads an i3d incrementally and only builds (xmltodict style) trees for the requested subtrees, everything else
+        stays in the file as raw byte spans that are copied unchanged by `write`. `data` is a skeleton document holding
+        the requested subtrees under their ancestors (with the ancestors' attributes) so the usual lookups work on it
+        :param path: the i3d file
+        :param subtrees: element names or `name` attributes to materialize, parsing stops once each has been found
+        """
+        self.path = path
+        self.subtrees = tuple(subtrees or self.default_subtrees)
+        self.encoding = "utf-8"
+        self.spans = []
+        self.data = PartialDocument()
+        self._scan()
+
+    def _scan(self):
+        wanted = set(self.subtrees)
+        found = set()
+        stack = []
+        captured = []
+        parser = expat.ParserCreate()
+
+        def declaration(version, encoding, standalone):
+            if encoding:
+                self.encoding = encoding
+
+        def start(tag, attributes):
+            inside = any(frame[3] for frame in stack)
+            key = tag if tag in wanted else attributes.get("name")
+            capture = not inside and key in wanted
+            stack.append((tag, attributes, parser.CurrentByteIndex, capture))
+            if capture:
+                found.add(key)
+
+        def end(tag):
+            tag, attributes, offset, capture = stack.pop()
+            if capture:
+                captured.append((list(stack), tag, offset, parser.CurrentByteIndex, len(stack)))
+                if found == wanted:
+                    raise _SpansFound()
+
+        parser.XmlDeclHandler = declaration
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        with open(self.path, "rb") as fi:
+            try:
+                parser.ParseFile(fi)
+            except _SpansFound:
+                pass
+            ancestors = {}
+            for parents, tag, offset, end_offset, depth in captured:
+                _start_tag, _empty, stop = _element_end(fi, offset, end_offset)
+                self.spans.append(ElementSpan(tag=tag, start=offset, end=stop, depth=depth))
+                parent = self.data
+                for parent_tag, attributes, parent_offset, _capture in parents:
+                    if parent_offset not in ancestors:
+                        node = collections.OrderedDict((f"@{k}", v) for k, v in attributes.items())
+                        _add_child(parent, parent_tag, node)
+                        ancestors[parent_offset] = node
+                    parent = ancestors[parent_offset]
+                fi.seek(offset)
+                _add_child(parent, tag, parse(fi.read(stop - offset), encoding=self.encoding)[tag])
+
+    def passthrough(self) -> list:
+        """
+        the (start, stop) byte ranges of the file that were not materialized
+        """
+        ranges = []
+        position = 0
+        for span in self.spans:
+            if span.start > position:
+                ranges.append((position, span.start))
+            position = span.end
+        size = os.path.getsize(self.path)
+        if position < size:
+            ranges.append((position, size))
+        return ranges
+
+    def raw(self, start: int, stop: int) -> bytes:
+        with open(self.path, "rb") as fi:
+            fi.seek(start)
+            return fi.read(stop - start)
+
+    def write(self, path: str, replacements: dict, **kwargs):
+        """
+        copies the source file to `path` replacing the children of the named elements, see `write_stream`
+        """
+        write_stream(self.path, path, replacements, **kwargs)
+
+
+def get_for_type(type: str, i3d: dict, index: "NodeIndex" = None) -> list:
+    if index is not None:
+        return index.get_for_type(type)
     found = []
     map_to_key(obj=i3d, key=type, callback=found.append)
     return found
 
 
-def get_for_key(key: str, value: str, i3d: dict) -> list:
+def get_for_key(key: str, value: str, i3d: dict, index: "NodeIndex" = None) -> list:
+    if index is not None and key in index.keys:
+        return index.get_for_key(key, value)
     found = []
 
     def check_key(tup: tuple):
@@ -66,14 +417,144 @@ def get_for_id():
     return found
 
 
+class NodeIndex:
+    def __init__(self, i3d: dict, keys: tuple = ("@name", "@nodeId", "@fileId")):
+        """
+        indexes a parsed i3d once so lookups by attribute value or element type don't have to walk the document. gives
+        the same results (and parent paths) as `get_for_key`/`get_for_type`, subtrees have to be swapped with `replace`
+        to keep it up to date
+        :param i3d: the parsed document
+        :param keys: attributes to index
+        """
+        self.keys = tuple(keys)
+        self._by_key = {key: {} for key in self.keys}
+        self._by_type = {}
+        self._parents = {}
+        self._add(i3d, [])
+
+    @staticmethod
+    def _walk(node: dict, parents: list):
+        stack = [(node, parents)]
+        while stack:
+            obj, path = stack.pop()
+            yield obj, path
+            children = []
+            for key, value in obj.items():
+                if isinstance(value, dict):
+                    children.append((value, path + [key]))
+                elif isinstance(value, list):
+                    child_path = path + [key]
+                    children.extend((item, child_path) for item in value if isinstance(item, dict))
+            stack.extend(reversed(children))
+
+    def _add(self, node: dict, parents: list):
+        for obj, path in self._walk(node, parents):
+            self._parents[id(obj)] = (obj, path)
+            for key, value in obj.items():
+                if key in self._by_key:
+                    self._by_key[key].setdefault(value, {})[id(obj)] = obj
+                elif not key.startswith("@"):
+                    self._by_type.setdefault(key, {})[id(obj)] = obj
+
+    def _remove(self, node: dict):
+        for obj, _path in self._walk(node, []):
+            self._parents.pop(id(obj), None)
+            for key, value in obj.items():
+                if key in self._by_key:
+                    self._by_key[key].get(value, {}).pop(id(obj), None)
+                elif not key.startswith("@"):
+                    self._by_type.get(key, {}).pop(id(obj), None)
+
+    def __getstate__(self):
+        # the lookups are keyed by id(), they are stored as lists of the nodes and keyed again when loaded
+        return {
+            "keys": self.keys,
+            "by_key": {key: {value: list(nodes.values()) for value, nodes in values.items()}
+                       for key, values in self._by_key.items()},
+            "by_type": {key: list(nodes.values()) for key, nodes in self._by_type.items()},
+            "parents": list(self._parents.values()),
+        }
+
+    def __setstate__(self, state):
+        self.keys = state["keys"]
+        self._by_key = {key: {value: {id(obj): obj for obj in nodes} for value, nodes in values.items()}
+                        for key, values in state["by_key"].items()}
+        self._by_type = {key: {id(obj): obj for obj in nodes} for key, nodes in state["by_type"].items()}
+        self._parents = {id(obj): (obj, path) for obj, path in state["parents"]}
+
+    def get_for_key(self, key: str, value: str) -> list:
+        return [(obj, list(self._parents[id(obj)][1])) for obj in self._by_key[key].get(value, {}).values()]
+
+    def get_for_type(self, type: str) -> list:
+        return [obj[type] for obj in self._by_type.get(type, {}).values()]
+
+    def parents(self, node: dict) -> list:
+        return list(self._parents[id(node)][1])
+
+    def replace(self, node: dict, key: str, value):
+        """
+        sets `node[key] = value` and re-indexes the subtrees that were removed and added
+        """
+        for child, _path in self._children(node.get(key)):
+            self._remove(child)
+        node[key] = value
+        self._by_type.setdefault(key, {})[id(node)] = node
+        parents = self._parents[id(node)][1] + [key]
+        for child, _path in self._children(value):
+            self._add(child, parents)
+
+    @staticmethod
+    def _children(value) -> list:
+        if isinstance(value, dict):
+            return [(value, None)]
+        if isinstance(value, list):
+            return [(item, None) for item in value if isinstance(item, dict)]
+        return []
+
+
+def _read_indexed(path: str, lazy: bool, subtrees: tuple) -> tuple:
+    document = LazyI3d(path, subtrees=subtrees) if lazy else None
+    data = document.data if lazy else read(path)
+    return document, data, NodeIndex(data)
+
+
 class TransformGroup:
-    def __init__(self, i3d: dict = None, file: str = None):
+    def __init__(self, i3d: dict = None, file: str = None, lazy: bool = False, subtrees: tuple = None,
+                 index: NodeIndex = None, cache=None):
+        """
+        :param i3d: parsed i3d data
+        :param file: i3d file to read when no data is given
+        :param lazy: only materialize `subtrees` of the file (see LazyI3d), it has to be written with `write_stream`
+        :param subtrees: element names or `name` attributes to materialize in lazy mode
+        :param index: an existing NodeIndex of `i3d` to share, one is built on the first lookup otherwise
+        :param cache: a DiskCache that keeps the parsed file and its index between runs
+        """
         self._prefix = "@"
         self.file = file
         self.data = i3d
+        self.document = None
+        self.__index = index
         self.default_label = 'TransformGroup'
         if not self.data and self.file:
-            self.data = read(file)
+            if cache is not None:
+                subtrees = tuple(subtrees or LazyI3d.default_subtrees) if lazy else None
+                self.document, self.data, self.__index = cache.pickled(file, _read_indexed, lazy, subtrees)
+                if self.document is not None:
+                    self.document.path = file
+            elif lazy:
+                self.document = LazyI3d(file, subtrees=subtrees)
+                self.data = self.document.data
+            else:
+                self.data = read(file)
+
+    @property
+    def index(self) -> NodeIndex:
+        if self.__index is None and self.data is not None:
+            self.__index = NodeIndex(self.data)
+        return self.__index
+
+    def _index_for(self, data: dict):
+        return self.index if data is None or data is self.data else None
 
     def prefix(self, term: str) -> str:
         return f"{self._prefix}{term}"
@@ -108,10 +589,19 @@ class TransformGroup:
         return transform_group
 
     def get_transform_group(self, data, target) -> list:
-        return get_for_type(target, data)
+        return get_for_type(target, data, index=self._index_for(data))
 
     def get_by_name(self, name: str, i3d: dict = None):
-        return get_for_key(key=self.name, value=name, i3d=i3d or self.data)
+        return get_for_key(key=self.name, value=name, i3d=i3d or self.data, index=self._index_for(i3d))
+
+    def replace_children(self, node: dict, children, label: str = None):
+        """
+        replaces the children of a node in the document, keeping the index up to date
+        """
+        if self.data is None:
+            node[label or self.default_label] = children
+        else:
+            self.index.replace(node, label or self.default_label, children)
 
 
 class Terrain(TransformGroup):
@@ -128,7 +618,7 @@ class Terrain(TransformGroup):
         files = []
         for item in tg:
             height_map = item[self.prefix('heightMapId')]
-            files.extend(get_for_key(self.prefix("fileId"), height_map, self.data))
+            files.extend(get_for_key(self.prefix("fileId"), height_map, self.data, index=self.index))
         return files
 
 
@@ -1,3 +1,4 @@
+import collections
 import os
 from contextlib import contextmanager
 
@@ -14,3 +15,26 @@ def shape_readers(shp, shx, dbf):
         with open(shx, "rb") as sxi:
             with open(dbf, "rb") as dbi:
                 yield {'shp': spi, 'shx': sxi, 'dbf': dbi}
+
+
+def iter_dbf_records(dbf: str, fields: list = None, key: str = None, targets: set = None):
+    """
+    streams the attributes of a shapefile from its .dbf alone, the geometry is never read
+    :param dbf: the .dbf (or any other component of the shapefile)
+    :param fields: names of the fields to keep, all of them when None (missing names are skipped)
+    :param key: the field `targets` refers to
+    :param targets: only yield the records whose `key` is in this set
+    :return: yields a namedtuple of the kept fields per record
+    """
+    import shapefile
+
+    with open(shape_components(dbf)['dbf'], "rb") as dbi:
+        reader = shapefile.Reader(dbf=dbi)
+        names = [field[0] for field in reader.fields if field[0] != "DeletionFlag"]
+        keep = [i for i, name in enumerate(names) if fields is None or name in fields]
+        Record = collections.namedtuple("Record", [names[i] for i in keep], rename=True)
+        key_index = names.index(key) if targets is not None else None
+        for values in reader.iterRecords():
+            if targets is not None and values[key_index] not in targets:
+                continue
+            yield Record(*[values[i] for i in keep])
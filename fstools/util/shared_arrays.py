@@ -0,0 +1,48 @@
+import mmap
+import os
+
+import numpy
+
+
+class SharedArray:
+    def __init__(self, path: str):
+        """
+        stands in for a memmap backed array while pickling so a worker process maps the same file instead of
+        receiving a copy of the data
+        :param path: the .npy file behind the memmap
+        """
+        self.path = path
+
+    def load(self) -> numpy.ndarray:
+        return numpy.load(self.path, mmap_mode='r')
+
+
+def _is_mapped_file(array) -> bool:
+    # a whole mapped file, slices of a memmap keep the filename but not the mmap as their base
+    return isinstance(array, numpy.memmap) and bool(array.filename) and isinstance(array.base, mmap.mmap)
+
+
+def share(array: numpy.ndarray, directory: str, name: str) -> numpy.ndarray:
+    """
+    writes an array to `<directory>/<name>.npy` and maps it back read only, arrays that are already mapped from a .npy
+    file are returned as they are
+    """
+    if _is_mapped_file(array) and not array.flags.writeable:
+        return array
+    path = os.path.join(directory, f"{name}.npy")
+    numpy.save(path, numpy.asarray(array))
+    return numpy.load(path, mmap_mode='r')
+
+
+def pack_state(state: dict) -> dict:
+    """
+    replaces file backed arrays in an object's `__dict__` with their SharedArray so they pickle as a path
+    """
+    return {
+        key: SharedArray(value.filename) if _is_mapped_file(value) else value
+        for key, value in state.items()
+    }
+
+
+def unpack_state(state: dict) -> dict:
+    return {key: value.load() if isinstance(value, SharedArray) else value for key, value in state.items()}
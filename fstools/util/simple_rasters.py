@@ -1,18 +1,86 @@
-import imageio
+import os
+
 import numpy
 
 from fstools.util import generic_io
 
 
 def read(path: str) -> numpy.ndarray:
+    import imageio
     return generic_io.read(imageio.read, path)
 
 
-def write(array: numpy.ndarray, path: str, overwrite: bool = False) -> None:
-    def _write(_path, _array):
-        return imageio.imwrite(_array, _path)
+def write(array: numpy.ndarray, path: str, overwrite: bool = False, backup: bool = False, **options) -> None:
+    """
+    writes an image atomically, see `generic_io.write`
+    :param options: passed to `imageio.imwrite`, e.g. `compress_level` of a png
+    """
+    import imageio
+
+    def _write(_path, _array, _options):
+        return imageio.imwrite(_path, _array, **_options)
 
-    return generic_io.write(_write, overwrite=overwrite, path=path, _array=array)
+    return generic_io.write(_write, overwrite=overwrite, path=path, backup=backup, _array=array, _options=options)
 
 def read_img(path: str):
-    return generic_io.read(imageio.imread, path)
\ No newline at end of file
+    # imageio is only imported when an image has to be decoded, not when it is read from a cache
+    import imageio
+    return generic_io.read(imageio.imread, path)
+
+
+def sidecar_path(path: str) -> str:
+    return os.fspath(path) + ".npy"
+
+
+def _write_sidecar(array: numpy.ndarray, path: str) -> None:
+    temporary = path + ".tmp"
+    try:
+        with open(temporary, "wb") as fo:
+            numpy.save(fo, numpy.asarray(array))
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def read_mapped(path: str, sidecar: bool = False, cache=None) -> numpy.ndarray:
+    """
+    reads an image as a read only memmap of an uncompressed copy, so only the parts that are used are paged in. the
+    copy is kept in `cache` when one is given, otherwise the image is decoded into memory
+    :param path: the png/tif to read
+    :param sidecar: without a cache, store the copy next to the image (`<image>.npy`, rewritten when it is older than
+    the image) instead of decoding it into memory. the copy is as large as the raw raster, so only opt in where
+    writing it next to the image is fine. when the copy can't be written the image is read into memory
+    :param cache: a DiskCache to keep the decoded image in
+    """
+    path = os.fspath(path)
+    if cache is not None:
+        generic_io.read(os.path.exists, path)
+        return cache.array(path, read_img)
+    if not sidecar:
+        return read_img(path)
+    cache = sidecar_path(path)
+    if not os.path.exists(cache) or os.path.getmtime(cache) < generic_io.read(os.path.getmtime, path):
+        array = read_img(path)
+        try:
+            _write_sidecar(array, cache)
+        except OSError:
+            return array
+        del array
+    return numpy.load(cache, mmap_mode='r')
+
+
+def read_window(path: str, rows: slice, columns: slice, sidecar: bool = False, cache=None) -> numpy.ndarray:
+    """
+    reads a (rows, columns) window of an image into memory, see `read_mapped`
+    """
+    return numpy.array(read_mapped(path, sidecar=sidecar, cache=cache)[rows, columns])
+
+
+def windows(shape: tuple, size: int):
+    """
+    yields the (row, column) slices of the tiles of at most `size` x `size` cells covering an array, row by row
+    """
+    for row in range(0, shape[0], size):
+        for column in range(0, shape[1], size):
+            yield slice(row, min(row + size, shape[0])), slice(column, min(column + size, shape[1]))
@@ -1,34 +1,88 @@
+import multiprocessing
 import os
 import shutil
 
-import imageio
 import numpy
 
 from fstools.i18n import _
 from fstools.util import simple_rasters
 
 
-def create_samples(path: str, layers: int = 4):
-    image = simple_rasters.read(path)
-    out_layers = []
-    rand_array = numpy.random.randint(1, layers + 1, image.shape)
-    for x in range(1, layers + 1, 1):
-        mask = numpy.ma.equal(rand_array, x)
-        masked = image * mask
-        out_layers.append((masked, x))
-    return out_layers
+# zlib level of the weight pngs, 1 writes several times faster than the default (6) for slightly larger files
+FAST_PNG = 1
 
 
-def generate_weights(output: str, input_file: str, overwrite: bool = True, layers: int = 4):
-    samples = create_samples(input_file, layers=layers)
-    for sample, index in samples:
+def layer_assignment(shape: tuple, layers: int = 4, seed: int = None) -> numpy.ndarray:
+    """
+    the layer (1 to `layers`) each pixel is given to, drawn uniformly. a single small array instead of a mask per layer
+    :param seed: seed of the generator, random when None
+    """
+    dtype = numpy.uint8 if layers < 256 else numpy.uint16
+    return numpy.random.default_rng(seed).integers(1, layers + 1, shape, dtype=dtype)
+
+
+def iter_samples(path: str, layers: int = 4, seed: int = None):
+    """
+    the image split randomly over `layers` weight layers, a layer is only computed when it is asked for so a single
+    full size layer is held in memory at a time
+    :return: yields (layer, index) tuples, index starting at 1
+    """
+    image = simple_rasters.read_img(path)
+    assignment = layer_assignment(image.shape[:2], layers=layers, seed=seed)
+    if image.ndim > 2:
+        assignment = assignment[..., None]
+    for index in range(1, layers + 1):
+        yield numpy.where(assignment == index, image, 0).astype(image.dtype, copy=False), index
+
+
+def create_samples(path: str, layers: int = 4, seed: int = None):
+    return list(iter_samples(path, layers=layers, seed=seed))
+
+
+def generate_weights(output: str, input_file: str, overwrite: bool = True, layers: int = 4, seed: int = None,
+                     compress_level: int = None) -> list:
+    """
+    writes `<output>0N_weight.png` for every layer as soon as it is computed. every file is written atomically, an
+    existing weight is only replaced once the new one is complete and is kept as `.bak`
+    :param output: path prefix of the weight files (`.../mapNB1/animalMud`)
+    :param input_file: the image to split
+    :param overwrite: replace existing `.bak` files, otherwise the oldest backup is kept
+    :param layers: number of weight layers
+    :param seed: seed of the layer assignment, random when None
+    :param compress_level: png zlib level (0-9), `FAST_PNG` for fast writes, the imageio default when None
+    :return: the written paths
+    """
+    options = {} if compress_level is None else {"compress_level": compress_level}
+    targets = []
+    for sample, index in iter_samples(input_file, layers=layers, seed=seed):
         target = f"{output}0{str(index)}_weight.png"
-        if os.path.exists(target):
-            bak = target + ".bak"
-            if os.path.exists(bak) and overwrite is True:
-                os.remove(bak)
-            shutil.move(target, bak)
-        imageio.imwrite(target, sample)
+        backup = overwrite is True or not os.path.exists(target + ".bak")
+        simple_rasters.write(sample, target, overwrite=True, backup=backup, **options)
+        targets.append(target)
+        del sample
+    return targets
+
+
+def _generate_weights(job: tuple) -> list:
+    output, input_file, options = job
+    return generate_weights(output, input_file, **options)
+
+
+def generate_many(jobs: list, workers: int = 1, seed: int = None, **options) -> list:
+    """
+    runs `generate_weights` for several inputs, `workers` at a time in their own processes
+    :param jobs: (output, input_file) pairs
+    :param seed: every job gets its own seed derived from it and the job's position, random when None
+    :param options: the other `generate_weights` arguments
+    :return: the written paths of every job, in job order
+    """
+    seeds = numpy.random.SeedSequence(seed).spawn(len(jobs))
+    jobs = [(output, input_file, dict(options, seed=job_seed.generate_state(1)[0]))
+            for (output, input_file), job_seed in zip(jobs, seeds)]
+    if workers <= 1:
+        return [_generate_weights(job) for job in jobs]
+    with multiprocessing.get_context().Pool(min(workers, len(jobs) or 1)) as pool:
+        return pool.map(_generate_weights, jobs, chunksize=1)
 
 
 def main(output: str, input_file: str = "blank.png", overwrite: bool = False, layers: int = 4):
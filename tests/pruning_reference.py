@@ -0,0 +1,31 @@
+"""
+the original per cell neighbor pruning, the reference `pruning.prune_neighbors` is tested and benchmarked against
+"""
+from contextlib import suppress
+
+import numpy
+
+
+def legacy_prune_neighbors(arr: numpy.ndarray, distance=2):
+    comp_arr = numpy.full(arr.shape, True, dtype=int)
+    for (x, y), item in numpy.ndenumerate(arr):
+        summed = 0
+        if item > 0:
+            for xd in range(x-distance, x+distance+1):
+                if summed > 1:
+                    continue
+                for yd in range(y-distance, y+distance+1):
+                    with suppress(IndexError):
+                        summed += (1 if arr[xd][yd] > 0 else 0)
+        comp_arr[x][y] = int(summed)
+    mask = numpy.ma.greater(comp_arr, 1)
+    return arr * mask
+
+
+def synthetic_aoi(size: int, species: int = 4, seed: int = 0) -> numpy.ndarray:
+    rng = numpy.random.default_rng(seed)
+    label = numpy.zeros((size, size), dtype=bool)
+    quarter = size // 4
+    label[quarter:size - quarter, :] = True
+    label[:, :quarter] = True
+    return rng.integers(0, species - 1, (size, size)) * label
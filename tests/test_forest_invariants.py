@@ -0,0 +1,57 @@
+"""
+the generated forests must not depend on how they are generated: tile size, number of workers and the forest cache
+all have to write the same bytes
+"""
+import os
+
+import numpy
+import pytest
+
+from benchmarks import fixtures
+from fstools.generate.forests import pruning
+from fstools.generate.forests.forestGenerator import ForestGenerator
+from fstools.generate.forests.instrumentation import Instrumentation
+from tests.pruning_reference import legacy_prune_neighbors, synthetic_aoi
+
+SEED = 7
+
+
+@pytest.fixture(scope="module")
+def paths(tmp_path_factory):
+    return fixtures.build_map(str(tmp_path_factory.mktemp("map")), size=256, forests=6, seed=3)
+
+
+def _generate(paths: dict, output: str, **options) -> bytes:
+    generator = ForestGenerator(paths["i3d"], "baseTrees", paths["raster"], xml_raster_metadata=paths["xml"],
+                                cache=False, instrumentation=Instrumentation(quiet=True))
+    generator.write(output, forests=generator.iter_forests(seed=SEED, **options))
+    with open(output, "rb") as fi:
+        return fi.read()
+
+
+@pytest.fixture(scope="module")
+def reference(paths, tmp_path_factory):
+    return _generate(paths, str(tmp_path_factory.mktemp("reference") / "map.i3d"))
+
+
+@pytest.mark.parametrize("tile_rows", [1, 7])
+def test_tile_rows(paths, reference, tmp_path, tile_rows):
+    assert _generate(paths, str(tmp_path / "map.i3d"), tile_rows=tile_rows) == reference
+
+
+def test_workers(paths, reference, tmp_path):
+    assert _generate(paths, str(tmp_path / "map.i3d"), workers=2) == reference
+
+
+def test_forest_cache(paths, reference, tmp_path):
+    cache_dir = str(tmp_path / "forests")
+    assert _generate(paths, str(tmp_path / "miss.i3d"), cache_dir=cache_dir) == reference
+    assert os.listdir(cache_dir)
+    assert _generate(paths, str(tmp_path / "hit.i3d"), cache_dir=cache_dir) == reference
+
+
+@pytest.mark.parametrize("distance", [1, 2])
+def test_prune_neighbors(distance):
+    aoi = synthetic_aoi(64, seed=distance)
+    legacy = legacy_prune_neighbors(aoi, distance=distance)
+    assert numpy.array_equal(numpy.asarray(legacy) > 0, pruning.prune_neighbors(aoi, distance=distance))